@@ -1,12 +1,15 @@
 import os
 import json
+import base64
 import boto3
-import uuid
 import time
-import shutil
+import queue
+import threading
 from datetime import datetime, timezone
 from urllib.parse import unquote_plus
-import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from contextlib import contextmanager
 import paramiko
 import io
 import logging
@@ -15,50 +18,125 @@ import logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# SFTP tuning: larger write requests and channel windows keep more data in flight per round trip.
+# OpenSSH's sftp-server drops messages over 256 KiB including headers, so writes stay at 255 KiB.
+SFTP_MAX_REQUEST_SIZE = 261120
+SSH_WINDOW_SIZE = 2**27
+SSH_MAX_PACKET_SIZE = 2**19
+
+paramiko.sftp_file.SFTPFile.MAX_REQUEST_SIZE = SFTP_MAX_REQUEST_SIZE
+
+# Pooled sessions idle for longer than this are probed before reuse, since firewalls and server idle
+# timeouts drop connections while a warm container is frozen; the probe gives up after a few seconds
+SFTP_IDLE_PROBE_SECONDS = 30
+SFTP_PROBE_TIMEOUT_SECONDS = 5
+
+# Negotiate AES-GCM first: it runs on AES-NI and authenticates in the same pass, so bulk
+# SFTP bytes skip the separate HMAC. paramiko's remaining algorithms stay as fallbacks.
+PREFERRED_CIPHERS = ('aes128-gcm@openssh.com', 'aes256-gcm@openssh.com', 'aes128-ctr')
+PREFERRED_MACS = ('hmac-sha2-256-etm@openssh.com',)
+
+paramiko.Transport._preferred_ciphers = PREFERRED_CIPHERS + tuple(
+    cipher for cipher in paramiko.Transport._preferred_ciphers if cipher not in PREFERRED_CIPHERS
+)
+paramiko.Transport._preferred_macs = PREFERRED_MACS + tuple(
+    mac for mac in paramiko.Transport._preferred_macs if mac not in PREFERRED_MACS
+)
+
+# Downloaded chunks buffered per destination while S3 and SFTP stream concurrently.
+# Chunks match the SFTP write size so every chunk goes out as one write request.
+FANOUT_QUEUE_SIZE = 32
+S3_TRANSFER_CONFIG = TransferConfig(io_chunksize=SFTP_MAX_REQUEST_SIZE)
+
+# AWS clients are created once per container and reused by warm invocations
+S3 = boto3.client('s3')
+CW = boto3.client('cloudwatch')
+
+# PutMetricData accepts up to 1000 metric entries per request
+MAX_METRICS_PER_CALL = 1000
+
+# On-premises destinations, in priority order: op1 (Metzuda), op2 (Marganit)
+ONPREM_LOCATIONS = ('op1', 'op2')
+
+# Records in one invocation are processed by up to this many workers
+MAX_RECORD_WORKERS = 10
+
+# Records not yet started this close to the function's timeout are reported as failures for SQS to
+# redeliver, so the invocation returns its batchItemFailures instead of timing out with the whole
+# batch, including files already delivered, going back to the queue
+RECORD_DEADLINE_MARGIN_SECONDS = 60
+
+# Files sent by direct invocation are archived under this prefix after delivery; the
+# S3 notification path skips it so they aren't sent on-premises a second time
+DIRECT_ARCHIVE_PREFIX = 'direct/'
+
+# SSH connections to each on-premises endpoint, keyed by (host, port). Every record worker gets its
+# own connection so transfers don't share a transport's throughput; op1 and op2 pointing at the
+# same endpoint open their sessions as two channels on one connection instead of two handshakes.
+_SSH_CONNECTIONS = {}
+
+# Idle SFTP sessions kept open across warm invocations, keyed by (location, host, port), with the time
+# each was returned. Workers check sessions out for exclusive use since paramiko SFTP clients are not
+# shared safely.
+_SFTP_POOL = {}
+_SFTP_POOL_LOCK = threading.Lock()
+
+# Remote directories known to exist, keyed by (location, path)
+_DIR_CACHE = set()
+
+# On-premises credentials are cached in-process to avoid a Secrets Manager query per invocation
+CREDENTIALS_TTL_SECONDS = 300
+_SM_CLIENT = boto3.client('secretsmanager')
+_SECRET_CACHE = {"value": None, "expiry": 0}
+
 def get_current_path():
     """Get current UTC time folder path: yyyy/MM/DD/HH"""
     now = datetime.now(timezone.utc)
     return now.strftime("%Y/%m/%d/%H")
 
 def get_onprem_credentials():
-    """Get on-premises credentials from AWS Secrets Manager"""
+    """Get on-premises credentials from AWS Secrets Manager, cached for CREDENTIALS_TTL_SECONDS"""
+    if _SECRET_CACHE["value"] is not None and time.monotonic() < _SECRET_CACHE["expiry"]:
+        return _SECRET_CACHE["value"]
+    
     try:
-        secret_client = boto3.client('secretsmanager')
-        secret_response = secret_client.get_secret_value(
+        secret_response = _SM_CLIENT.get_secret_value(
             SecretId=os.environ['ONPREM_SECRET_NAME']
         )
-        return json.loads(secret_response['SecretString'])
+        _SECRET_CACHE["value"] = json.loads(secret_response['SecretString'])
+        _SECRET_CACHE["expiry"] = time.monotonic() + CREDENTIALS_TTL_SECONDS
+        return _SECRET_CACHE["value"]
     except Exception as e:
-        logger.error(f"Error getting on-premises credentials: {str(e)}")
+        logger.error("Error getting on-premises credentials: %s", e)
         raise
 
 def send_metrics(cloudwatch, metrics_data):
-    """Send custom metrics to CloudWatch"""
-    try:
-        cloudwatch.put_metric_data(
-            Namespace='MOD/FileTransfer',
-            MetricData=metrics_data
-        )
-    except Exception as e:
-        logger.error(f"Error sending metrics: {str(e)}")
+    """Send custom metrics to CloudWatch, at most MAX_METRICS_PER_CALL per request"""
+    for i in range(0, len(metrics_data), MAX_METRICS_PER_CALL):
+        try:
+            cloudwatch.put_metric_data(
+                Namespace='MOD/FileTransfer',
+                MetricData=metrics_data[i:i + MAX_METRICS_PER_CALL]
+            )
+        except Exception as e:
+            logger.error("Error sending metrics: %s", e)
 
-def transfer_file_to_onprem(file_path, file_content, credentials, location):
-    """Transfer file to specific on-premises system using SFTP with network-based trust"""
-    temp_file_path = f"/tmp/{uuid.uuid4()}"
+def statistic_set(values):
+    """Summarize per-file samples as a CloudWatch StatisticValues set"""
+    return {
+        'SampleCount': len(values),
+        'Sum': sum(values),
+        'Minimum': min(values),
+        'Maximum': max(values)
+    }
+
+def connect_ssh(host, port):
+    """Open an SSH connection to an on-premises host"""
+    # Create SSH client
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     
     try:
-        # Write content to temporary file
-        with open(temp_file_path, 'wb') as f:
-            f.write(file_content)
-        
-        # Get location-specific credentials
-        host = credentials[f'{location}_host']
-        port = int(credentials[f'{location}_port'])
-        
-        # Create SSH client
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
         # Connect using network-based trust (no username/password or keys)
         client.connect(
             hostname=host,
@@ -68,170 +146,556 @@ def transfer_file_to_onprem(file_path, file_content, credentials, location):
             timeout=30
         )
         
-        # Create SFTP client from SSH connection
-        sftp = client.open_sftp()
+        # Enlarge the window of every channel opened later so SFTP writes are pipelined
+        transport = client.get_transport()
+        transport.default_window_size = SSH_WINDOW_SIZE
+        transport.default_max_packet_size = SSH_MAX_PACKET_SIZE
+    except Exception:
+        client.close()
+        raise
+    
+    return client
+
+def is_connected(client):
+    """Check whether an SSH client still has a live transport"""
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+class SSHConnection:
+    """SSH connection carrying at most one SFTP session per on-premises location"""
+    
+    def __init__(self):
+        # Resolved with the SSHClient once the handshake finishes, so the other location can
+        # wait on it instead of starting a second handshake to the same endpoint
+        self.client = Future()
+        self.locations = set()
+        # Set once a session on it stops answering, though the transport may still look active
+        self.broken = False
+    
+    def is_usable(self):
+        if self.broken:
+            return False
+        if not self.client.done():
+            return True
+        return self.client.exception() is None and is_connected(self.client.result())
+
+def claim_connection(endpoint, location):
+    """Reserve a session slot for a location on an endpoint's connections; call with _SFTP_POOL_LOCK held"""
+    connections = _SSH_CONNECTIONS.setdefault(endpoint, [])
+    for connection in connections:
+        if location not in connection.locations and connection.is_usable():
+            connection.locations.add(location)
+            return connection, False
+    
+    connection = SSHConnection()
+    connection.locations.add(location)
+    connections.append(connection)
+    return connection, True
+
+def release_connection(endpoint, connection, location):
+    """Free a location's session slot, closing the connection once no session uses it"""
+    with _SFTP_POOL_LOCK:
+        connection.locations.discard(location)
+        if connection.locations or connection not in _SSH_CONNECTIONS.get(endpoint, []):
+            return
+        _SSH_CONNECTIONS[endpoint].remove(connection)
+    
+    if connection.client.done() and connection.client.exception() is None:
+        connection.client.result().close()
+
+def probe_session(sftp):
+    """Round-trip an idle session; a TCP connection dropped while the container was frozen looks open until used"""
+    channel = sftp.get_channel()
+    channel.settimeout(SFTP_PROBE_TIMEOUT_SECONDS)
+    try:
+        sftp.normalize('.')
+    finally:
+        channel.settimeout(None)
+
+def checkout_idle_session(endpoint, location, idle):
+    """Take an idle pooled session that still answers, discarding dead ones; None if there is none left"""
+    while True:
+        with _SFTP_POOL_LOCK:
+            if not idle:
+                return None
+            connection, sftp, idle_since = idle.pop()
         
-        # Ensure remote directory exists
-        remote_dir = os.path.dirname(file_path)
-        create_remote_directory(sftp, remote_dir)
+        try:
+            # Sessions left over from a dropped transport have closed channels
+            if sftp.get_channel().closed or not connection.is_usable():
+                raise IOError("transport closed")
+            if time.monotonic() - idle_since > SFTP_IDLE_PROBE_SECONDS:
+                probe_session(sftp)
+            return connection, sftp
+        except Exception as e:
+            logger.info("Discarding stale SFTP session to %s: %s", location, e)
+            # The other location's session shares the TCP connection, so no new session is
+            # opened on it; it is closed once that session is discarded too
+            connection.broken = True
+            sftp.close()
+            release_connection(endpoint, connection, location)
+
+@contextmanager
+def pooled_sftp(location, credentials):
+    """Check out a pooled SFTP client for an on-premises location, reconnecting if the transport dropped"""
+    # Get location-specific credentials
+    host = credentials[f'{location}_host']
+    port = int(credentials[f'{location}_port'])
+    endpoint = (host, port)
+    
+    with _SFTP_POOL_LOCK:
+        idle = _SFTP_POOL.setdefault((location, host, port), [])
+    session = checkout_idle_session(endpoint, location, idle)
+    
+    if session is None:
+        with _SFTP_POOL_LOCK:
+            connection, handshake = claim_connection(endpoint, location)
+        try:
+            if handshake:
+                try:
+                    connection.client.set_result(connect_ssh(host, port))
+                except Exception as e:
+                    connection.client.set_exception(e)
+                    raise
+            # The other location's session may already be a channel on this connection
+            session = (connection, connection.client.result().open_sftp())
+        except Exception:
+            release_connection(endpoint, connection, location)
+            raise
+    
+    try:
+        yield session[1]
+    except Exception:
+        # Don't hand a session in an unknown state to the next worker
+        session[1].close()
+        release_connection(endpoint, session[0], location)
+        raise
+    
+    with _SFTP_POOL_LOCK:
+        idle.append((session[0], session[1], time.monotonic()))
+
+def open_onprem_connections(credentials):
+    """Make sure each on-premises location has a pooled SFTP session that answers, before any file is sent"""
+    def connect(location):
+        try:
+            # Checkout replaces stale idle sessions; the round trip here also covers a session that
+            # is new or was idle only briefly, so the first file gets one that has just answered
+            with pooled_sftp(location, credentials) as sftp:
+                probe_session(sftp)
+        except Exception as e:
+            logger.error("Error connecting to on-premises %s: %s", location, e)
+    
+    with ThreadPoolExecutor(max_workers=len(ONPREM_LOCATIONS)) as executor:
+        list(executor.map(connect, ONPREM_LOCATIONS))
+
+class FanoutReader:
+    """Read end of a fan-out stream, consumed by one SFTP upload"""
+    
+    def __init__(self):
+        self.chunks = queue.Queue(maxsize=FANOUT_QUEUE_SIZE)
+        self.chunk = b''
+        self.offset = 0
+        self.eof = False
+        self.abandoned = False
+    
+    def read(self, size=-1):
+        if size < 0:
+            parts = []
+            while True:
+                data = self.read(65536)
+                if not data:
+                    return b''.join(parts)
+                parts.append(data)
         
-        # Upload file
-        sftp.put(temp_file_path, file_path)
+        # Short reads are fine: callers keep reading until they get b''
+        if self.offset >= len(self.chunk):
+            if self.eof:
+                return b''
+            chunk = self.chunks.get()
+            if isinstance(chunk, BaseException):
+                self.eof = True
+                raise IOError("Source download failed") from chunk
+            if chunk is None:
+                self.eof = True
+                return b''
+            self.chunk, self.offset = chunk, 0
         
-        logger.info(f"Successfully transferred file to on-premises {location}: {file_path}")
-        sftp.close()
-        client.close()
+        data = self.chunk[self.offset:self.offset + size]
+        self.offset += len(data)
+        return data
+    
+    def abandon(self):
+        """Stop consuming so the download is never blocked on this reader"""
+        self.abandoned = True
+        try:
+            while True:
+                self.chunks.get_nowait()
+        except queue.Empty:
+            pass
+
+class Fanout(io.RawIOBase):
+    """Non-seekable sink for download_fileobj that copies every chunk to several readers"""
+    
+    def __init__(self, readers):
+        super().__init__()
+        self.readers = readers
+        self.size = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, b):
+        chunk = bytes(b)
+        for reader in self.readers:
+            if not reader.abandoned:
+                reader.chunks.put(chunk)
+        self.size += len(chunk)
+        return len(chunk)
+    
+    def finish(self, error=None):
+        """Signal end of stream, or the download error, to every reader still consuming"""
+        for reader in self.readers:
+            if not reader.abandoned:
+                reader.chunks.put(error)
+
+def stream_to_onprem(remote_dir, file_name, reader, credentials, location):
+    """Upload a fan-out stream to one location, releasing the stream whatever the outcome"""
+    try:
+        return transfer_file_to_onprem(remote_dir, file_name, reader, credentials, location)
+    finally:
+        reader.abandon()
+
+def upload_stream(sftp, file_obj, file_path):
+    """Write a stream to the SFTP server as pipelined SFTP_MAX_REQUEST_SIZE write requests"""
+    # sftp.putfo reads its source 32 KiB at a time, which caps every write request at that size
+    size = 0
+    with sftp.open(file_path, 'wb') as remote_file:
+        remote_file.set_pipelined(True)
+        while True:
+            data = file_obj.read(SFTP_MAX_REQUEST_SIZE)
+            if not data:
+                break
+            remote_file.write(data)
+            size += len(data)
+    
+    # Confirm the upload the same way putfo does
+    remote_size = sftp.stat(file_path).st_size
+    if remote_size != size:
+        raise IOError(f"Size mismatch after upload: {remote_size} != {size}")
+    
+    return size
+
+def transfer_file_to_onprem(remote_dir, file_name, file_obj, credentials, location):
+    """Transfer file to specific on-premises system using SFTP with network-based trust"""
+    file_path = f"{remote_dir}/{file_name}"
+    try:
+        with pooled_sftp(location, credentials) as sftp:
+            # Ensure remote directory exists, unless an earlier file already did
+            if (location, remote_dir) not in _DIR_CACHE:
+                create_remote_directory(sftp, remote_dir, location)
+            
+            # Upload file, streaming from the S3 download as it arrives
+            try:
+                upload_stream(sftp, file_obj, file_path)
+            except Exception:
+                # Don't leave a partial file behind for on-premises consumers
+                try:
+                    sftp.remove(file_path)
+                except Exception:
+                    pass
+                raise
+        
+        logger.info("Successfully transferred file to on-premises %s: %s", location, file_path)
         
         return True
     except Exception as e:
-        logger.error(f"Error transferring file to on-premises {location}: {str(e)}")
+        logger.error("Error transferring file to on-premises %s: %s", location, e)
+        # The directory may have been removed remotely; check it again on the next file
+        _DIR_CACHE.discard((location, remote_dir))
         return False
-    finally:
-        # Clean up temporary files
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
 
-def create_remote_directory(sftp, remote_dir):
+def create_remote_directory(sftp, remote_dir, location):
     """Create remote directory structure if it doesn't exist"""
-    if remote_dir == '/':
-        return
+    # Try mkdir from the deepest unknown level upwards, so a new hour folder under an existing
+    # day costs a single round trip. A failed mkdir means the level exists or its parent is missing.
+    missing = []
+    path = remote_dir
+    while path not in ('', '/') and (location, path) not in _DIR_CACHE:
+        try:
+            sftp.mkdir(path)
+            break
+        except IOError:
+            try:
+                sftp.stat(path)
+                break
+            except IOError:
+                missing.append(path)
+                path = os.path.dirname(path)
     
-    try:
-        sftp.stat(remote_dir)
-    except IOError:
-        parent_dir = os.path.dirname(remote_dir)
-        create_remote_directory(sftp, parent_dir)
-        sftp.mkdir(remote_dir)
-
-def process_s3_event(record, s3_client, cloudwatch, credentials):
-    """Process a single S3 event record"""
-    start_time = time.time()
+    # Create the levels below it top-down; a concurrent worker may have created one already
+    for path in reversed(missing):
+        try:
+            sftp.mkdir(path)
+        except IOError:
+            sftp.stat(path)
+    
+    # Remember every level so later files in the same folder skip all round trips
+    path = remote_dir
+    while path not in ('', '/'):
+        _DIR_CACHE.add((location, path))
+        path = os.path.dirname(path)
+
+def process_s3_event(record, s3_client, file_stats, credentials, remote_dir):
+    """Process a single S3 event record, appending its stats to the invocation's samples"""
+    start_time = time.monotonic()
     bucket = record['s3']['bucket']['name']
     key = unquote_plus(record['s3']['object']['key'])
     
-    logger.info(f"Processing file {key} from bucket {bucket}")
+    logger.info("Processing file %s from bucket %s", key, bucket)
     
     try:
-        # Get the object from S3
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        file_content = response['Body'].read()
-        file_size = response['ContentLength']
-        
-        # Determine remote file path
+        # Determine remote file name
         file_name = os.path.basename(key)
-        remote_path = f"/From_AWS/{get_current_path()}/{file_name}"
         
-        # Track locations status
-        locations_status = {}
+        # Stream the object from S3 to both on-premises locations concurrently, so the
+        # download overlaps the uploads instead of finishing before they start
+        readers = {location: FanoutReader() for location in ONPREM_LOCATIONS}
+        fanout = Fanout(list(readers.values()))
+        with ThreadPoolExecutor(max_workers=len(ONPREM_LOCATIONS)) as executor:
+            futures = {
+                location: executor.submit(stream_to_onprem, remote_dir, file_name, reader, credentials, location)
+                for location, reader in readers.items()
+            }
+            try:
+                s3_client.download_fileobj(Bucket=bucket, Key=key, Fileobj=fanout, Config=S3_TRANSFER_CONFIG)
+            except Exception as e:
+                fanout.finish(e)
+                raise
+            fanout.finish()
         
-        # Transfer file to both on-premises locations
-        # First location: op1 (Metzuda) - first priority
-        locations_status['op1'] = transfer_file_to_onprem(remote_path, file_content, credentials, 'op1')
+        file_size = fanout.size
         
-        # Second location: op2 (Marganit) - second priority
-        locations_status['op2'] = transfer_file_to_onprem(remote_path, file_content, credentials, 'op2')
+        # Track locations status
+        locations_status = {location: future.result() for location, future in futures.items()}
         
         # Transfer is successful only if both transfers are successful
         overall_success = all(locations_status.values())
         
         # Track metrics
-        duration = time.time() - start_time
-        metrics = [
-            {
-                'MetricName': 'ExecutionTime',
-                'Value': duration,
-                'Unit': 'Seconds',
-                'Dimensions': [{'Name': 'FileName', 'Value': file_name}]
-            },
-            {
-                'MetricName': 'FileSize',
-                'Value': file_size,
-                'Unit': 'Bytes',
-                'Dimensions': [{'Name': 'FileName', 'Value': file_name}]
-            },
-            {
-                'MetricName': 'TransferSuccess',
-                'Value': 1 if overall_success else 0,
-                'Unit': 'Count',
-                'Dimensions': [{'Name': 'FileName', 'Value': file_name}]
-            }
-        ]
-        
-        send_metrics(cloudwatch, metrics)
+        duration = time.monotonic() - start_time
+        file_stats.append({
+            'duration': duration,
+            'size': file_size,
+            'success': 1 if overall_success else 0
+        })
         
-        logger.info(f"File: {file_name}, Size: {file_size} bytes, Duration: {duration:.2f}s, Success: {overall_success}")
-        logger.info(f"Location status - op1: {locations_status['op1']}, op2: {locations_status['op2']}")
+        logger.info("File: %s, Size: %s bytes, Duration: %.2fs, Success: %s", file_name, file_size, duration, overall_success)
+        logger.info("Location status - op1: %s, op2: %s", locations_status['op1'], locations_status['op2'])
         
         if overall_success:
-            logger.info(f"Successfully processed file {key} to both destinations")
+            logger.info("Successfully processed file %s to both destinations", key)
             return True
         else:
             failed_destinations = [loc for loc, status in locations_status.items() if not status]
-            logger.error(f"Failed to process file {key} to destinations: {', '.join(failed_destinations)}")
+            logger.error("Failed to process file %s to destinations: %s", key, ', '.join(failed_destinations))
             return False
             
     except Exception as e:
-        logger.error(f"Error processing file {key}: {str(e)}")
+        logger.error("Error processing file %s: %s", key, e)
         return False
 
+def process_direct_transfer(transfer, credentials, file_stats, remote_dir):
+    """Deliver a file passed in the invocation payload, then archive it in the trusted bucket.
+    
+    Returns the locations that received the file, so the caller knows whether resending it is safe.
+    """
+    start_time = time.monotonic()
+    key = transfer['key']
+    delivered = []
+    
+    logger.info("Processing directly invoked file %s", key)
+    
+    try:
+        body = base64.b64decode(transfer['body'])
+        file_name = os.path.basename(key)
+        
+        # The payload is already in memory, so each location gets its own reader over it
+        with ThreadPoolExecutor(max_workers=len(ONPREM_LOCATIONS)) as executor:
+            futures = {
+                location: executor.submit(transfer_file_to_onprem, remote_dir, file_name, io.BytesIO(body), credentials, location)
+                for location in ONPREM_LOCATIONS
+            }
+            locations_status = {location: future.result() for location, future in futures.items()}
+        
+        delivered = [loc for loc, status in locations_status.items() if status]
+        overall_success = all(locations_status.values())
+        
+        duration = time.monotonic() - start_time
+        file_stats.append({
+            'duration': duration,
+            'size': len(body),
+            'success': 1 if overall_success else 0
+        })
+        
+        logger.info("File: %s, Size: %s bytes, Duration: %.2fs, Success: %s", file_name, len(body), duration, overall_success)
+        
+        if not overall_success:
+            failed_destinations = [loc for loc, status in locations_status.items() if not status]
+            logger.error("Failed to process file %s to destinations: %s", key, ', '.join(failed_destinations))
+            return delivered
+        
+        # Archiving happens after delivery, off the latency path; the file is already on-premises
+        try:
+            S3.put_object(Bucket=os.environ['TRUSTED_BUCKET'], Key=f"{DIRECT_ARCHIVE_PREFIX}{key}", Body=body)
+        except Exception as e:
+            logger.error("Error archiving file %s: %s", key, e)
+        
+        logger.info("Successfully processed file %s to both destinations", key)
+        return delivered
+        
+    except Exception as e:
+        logger.error("Error processing file %s: %s", key, e)
+        return delivered
+
+def process_s3_records(s3_records, credentials, file_stats, remote_dir, context=None):
+    """Process S3 event records concurrently, returning whether each one was transferred successfully"""
+    if not s3_records:
+        return []
+    
+    def process(s3_record):
+        # Checked as each record starts, since records queue behind MAX_RECORD_WORKERS
+        if context is not None and context.get_remaining_time_in_millis() < RECORD_DEADLINE_MARGIN_SECONDS * 1000:
+            logger.warning("Not starting %s this close to the timeout", s3_record['s3']['object']['key'])
+            return False
+        return process_s3_event(s3_record, S3, file_stats, credentials, remote_dir)
+    
+    with ThreadPoolExecutor(max_workers=min(MAX_RECORD_WORKERS, len(s3_records))) as executor:
+        futures = [executor.submit(process, s3_record) for s3_record in s3_records]
+        return [future.result() for future in futures]
+
 def lambda_handler(event, context):
     """Main Lambda handler"""
-    start_time = time.time()
-    logger.info(f"Processing event: {json.dumps(event)}")
+    start_time = time.monotonic()
+    # Serializing the whole event is only worth it when debug output is wanted
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing event: %s", json.dumps(event))
     
-    # Initialize clients
-    s3_client = boto3.client('s3')
-    cloudwatch = boto3.client('cloudwatch')
+    # Get on-premises credentials. A direct transfer that fails here has written nothing, so it
+    # answers normally and the untrusted spoke can resend the file through the trusted bucket
+    try:
+        credentials = get_onprem_credentials()
+    except Exception:
+        if 'direct_transfer' not in event:
+            raise
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'message': 'On-premises credentials unavailable',
+                'total_files': 1,
+                'successful_files': 0,
+                'delivered_locations': []
+            })
+        }
     
-    # Get on-premises credentials
-    credentials = get_onprem_credentials()
+    # Connect to, or revalidate, on-premises locations once; every file reuses the pooled connections
+    open_onprem_connections(credentials)
     
     successful_files = 0
     total_files = 0
     
-    # Process S3 events from SQS
+    # On-premises locations a direct transfer reached, reported back to the invoking spoke
+    delivered_locations = None
+    
+    # SQS messages to be redelivered; the rest of the batch is deleted from the queue
+    failed_message_ids = []
+    
+    # Per-file samples, aggregated into statistic sets when metrics are sent
+    file_stats = []
+    
+    # Every file in this invocation goes to the same hourly folder on-premises
+    current_path = get_current_path()
+    remote_dir = f"/From_AWS/{current_path}"
+    
+    # Process S3 events, delivered directly by S3 or wrapped in SQS messages
     if 'Records' in event:
+        s3_records = []
+        # SQS message each S3 record arrived in, None for direct S3 notifications
+        message_ids = []
         for record in event['Records']:
+            # Direct S3 notifications carry the record itself, no envelope to decode
+            if record.get('eventSource') == 'aws:s3':
+                candidates = [record]
             # Check if this is an SQS message containing S3 event
-            if 'body' in record:
-                s3_event = json.loads(record['body'])
-                
-                if 'Records' in s3_event:
-                    for s3_record in s3_event['Records']:
-                        if s3_record.get('eventSource') == 'aws:s3' and s3_record.get('eventName', '').startswith('ObjectCreated'):
-                            total_files += 1
-                            if process_s3_event(s3_record, s3_client, cloudwatch, credentials):
-                                successful_files += 1
+            elif 'body' in record:
+                try:
+                    body = json.loads(record['body'])
+                    # Valid JSON that isn't an object (a list, string or number) has no Records either
+                    if not isinstance(body, dict):
+                        raise ValueError(f"expected a JSON object, got {type(body).__name__}")
+                    candidates = body.get('Records', [])
+                except ValueError as e:
+                    logger.error("Invalid SQS message body %s: %s", record.get('messageId'), e)
+                    failed_message_ids.append(record['messageId'])
+                    continue
+            else:
+                continue
+            
+            for s3_record in candidates:
+                # Archived copies of directly invoked files were delivered already
+                if unquote_plus(s3_record.get('s3', {}).get('object', {}).get('key', '')).startswith(DIRECT_ARCHIVE_PREFIX):
+                    continue
+                if s3_record.get('eventSource') == 'aws:s3' and s3_record.get('eventName', '').startswith('ObjectCreated'):
+                    s3_records.append(s3_record)
+                    message_ids.append(record.get('messageId'))
+        
+        total_files = len(s3_records)
+        results = process_s3_records(s3_records, credentials, file_stats, remote_dir, context)
+        successful_files = sum(results)
+        
+        # A message is retried if any file it announced failed
+        for message_id, success in zip(message_ids, results):
+            if not success and message_id is not None and message_id not in failed_message_ids:
+                failed_message_ids.append(message_id)
+    
+    # Process a small file sent in the payload by the untrusted spoke
+    elif 'direct_transfer' in event:
+        total_files = 1
+        delivered_locations = process_direct_transfer(event['direct_transfer'], credentials, file_stats, remote_dir)
+        successful_files = int(len(delivered_locations) == len(ONPREM_LOCATIONS))
     
     # Process scheduled event (hourly)
     else:
         # Get list of files from S3 bucket to process
         bucket_name = os.environ['TRUSTED_BUCKET']
-        current_path = get_current_path()
         
         try:
-            response = s3_client.list_objects_v2(
+            paginator = S3.get_paginator('list_objects_v2')
+            pages = paginator.paginate(
                 Bucket=bucket_name,
-                Prefix=current_path
+                Prefix=current_path,
+                PaginationConfig={'PageSize': 1000}
             )
             
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    total_files += 1
-                    record = {
-                        's3': {
-                            'bucket': {'name': bucket_name},
-                            'object': {'key': obj['Key']}
-                        }
+            # Skip folder placeholder keys; only real objects are transferred
+            s3_records = [
+                {
+                    's3': {
+                        'bucket': {'name': bucket_name},
+                        'object': {'key': obj['Key']}
                     }
-                    
-                    if process_s3_event(record, s3_client, cloudwatch, credentials):
-                        successful_files += 1
+                }
+                for page in pages
+                for obj in page.get('Contents', [])
+                if not obj['Key'].endswith('/')
+            ]
+            
+            total_files = len(s3_records)
+            successful_files = sum(process_s3_records(s3_records, credentials, file_stats, remote_dir, context))
         except Exception as e:
-            logger.error(f"Error listing objects: {str(e)}")
+            logger.error("Error listing objects: %s", e)
     
     # Track overall execution time
-    end_time = time.time()
+    end_time = time.monotonic()
     duration = end_time - start_time
     
     # Send batch metrics
@@ -260,16 +724,41 @@ def lambda_handler(event, context):
             'Unit': 'Percent'
         })
     
-    send_metrics(cloudwatch, batch_metrics)
+    if file_stats:
+        batch_metrics.extend([
+            {
+                'MetricName': 'ExecutionTime',
+                'StatisticValues': statistic_set([stats['duration'] for stats in file_stats]),
+                'Unit': 'Seconds'
+            },
+            {
+                'MetricName': 'FileSize',
+                'StatisticValues': statistic_set([stats['size'] for stats in file_stats]),
+                'Unit': 'Bytes'
+            },
+            {
+                'MetricName': 'TransferSuccess',
+                'StatisticValues': statistic_set([stats['success'] for stats in file_stats]),
+                'Unit': 'Count'
+            }
+        ])
+    
+    send_metrics(CW, batch_metrics)
     
-    logger.info(f"Processing complete. Total files: {total_files}, Successful: {successful_files}, Duration: {duration:.2f}s")
+    logger.info("Processing complete. Total files: %s, Successful: %s, Duration: %.2fs", total_files, successful_files, duration)
+    
+    response_body = {
+        'message': 'Processing complete',
+        'total_files': total_files,
+        'successful_files': successful_files,
+        'processing_time_seconds': duration
+    }
+    if delivered_locations is not None:
+        response_body['delivered_locations'] = delivered_locations
     
     return {
         'statusCode': 200,
-        'body': json.dumps({
-            'message': 'Processing complete',
-            'total_files': total_files,
-            'successful_files': successful_files,
-            'processing_time_seconds': duration
-        })
+        'body': json.dumps(response_body),
+        # Partial batch response for the SQS event source (ReportBatchItemFailures)
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
     }
\ No newline at end of file
@@ -0,0 +1,437 @@
+import base64
+import importlib.util
+import json
+import os
+import posixpath
+import threading
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "il-central-1")
+os.environ.setdefault("TRUSTED_BUCKET", "s3-trusted-bucket")
+
+# lambda/ is not a package, so the handler is loaded from its file
+_spec = importlib.util.spec_from_file_location(
+    "transfer_index", os.path.join(os.path.dirname(__file__), "..", "..", "lambda", "index.py")
+)
+index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(index)
+
+SAME_HOST = {"op1_host": "sftp", "op1_port": "22", "op2_host": "sftp", "op2_port": "22"}
+TWO_HOSTS = {"op1_host": "sftp1", "op1_port": "22", "op2_host": "sftp2", "op2_port": "22"}
+
+
+class FakeChannel:
+    def __init__(self):
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+
+class FakeSFTP:
+    """SFTP session over an in-memory tree of directories, counting round trips"""
+
+    def __init__(self, dirs=None):
+        self.dirs = dirs if dirs is not None else {"/"}
+        self.channel = FakeChannel()
+        self.closed = False
+        self.stale = False
+        self.calls = []
+
+    def get_channel(self):
+        return self.channel
+
+    def normalize(self, path):
+        self.calls.append(("normalize", path))
+        if self.stale:
+            raise OSError("Socket is closed")
+        return "/"
+
+    def mkdir(self, path):
+        self.calls.append(("mkdir", path))
+        if path in self.dirs or posixpath.dirname(path) not in self.dirs:
+            raise IOError("Failure")
+        self.dirs.add(path)
+
+    def stat(self, path):
+        self.calls.append(("stat", path))
+        if path not in self.dirs:
+            raise IOError("No such file")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+
+class FakeClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.sessions = []
+
+    def get_transport(self):
+        return self.transport
+
+    def open_sftp(self):
+        self.sessions.append(FakeSFTP())
+        return self.sessions[-1]
+
+    def close(self):
+        self.transport.active = False
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.fixture(autouse=True)
+def clean_pool():
+    index._SSH_CONNECTIONS.clear()
+    index._SFTP_POOL.clear()
+    index._DIR_CACHE.clear()
+    yield
+    index._SSH_CONNECTIONS.clear()
+    index._SFTP_POOL.clear()
+    index._DIR_CACHE.clear()
+
+
+@pytest.fixture
+def handshakes(monkeypatch):
+    """Every SSH connection opened, in order"""
+    clients = []
+
+    def connect_ssh(host, port):
+        clients.append(FakeClient())
+        return clients[-1]
+
+    monkeypatch.setattr(index, "connect_ssh", connect_ssh)
+    return clients
+
+
+# Fan-out stream
+
+def test_fanout_copies_every_chunk_to_each_reader():
+    readers = [index.FanoutReader(), index.FanoutReader()]
+    fanout = index.Fanout(readers)
+    fanout.write(b"abc")
+    fanout.write(b"def")
+    fanout.finish()
+
+    assert [reader.read() for reader in readers] == [b"abcdef", b"abcdef"]
+    assert fanout.size == 6
+
+
+def test_fanout_reader_short_reads_until_eof():
+    reader = index.FanoutReader()
+    fanout = index.Fanout([reader])
+    fanout.write(b"abcdef")
+    fanout.finish()
+
+    assert reader.read(4) == b"abcd"
+    assert reader.read(4) == b"ef"
+    assert reader.read(4) == b""
+
+
+def test_fanout_reader_raises_download_error():
+    reader = index.FanoutReader()
+    fanout = index.Fanout([reader])
+    fanout.write(b"abc")
+    fanout.finish(RuntimeError("download failed"))
+
+    assert reader.read(3) == b"abc"
+    with pytest.raises(IOError):
+        reader.read(3)
+
+
+def test_abandoned_reader_never_blocks_the_download():
+    stuck, consumer = index.FanoutReader(), index.FanoutReader()
+    fanout = index.Fanout([stuck, consumer])
+    stuck.abandon()
+
+    received = []
+    drain = threading.Thread(target=lambda: received.append(consumer.read()))
+    drain.start()
+    # More chunks than the queue holds; a write to the abandoned reader would block here
+    for _ in range(index.FANOUT_QUEUE_SIZE * 2):
+        fanout.write(b"x")
+    fanout.finish()
+    drain.join(timeout=5)
+
+    assert received == [b"x" * index.FANOUT_QUEUE_SIZE * 2]
+
+
+# SSH connection pool
+
+def test_locations_on_the_same_endpoint_share_a_connection(handshakes):
+    with index.pooled_sftp("op1", SAME_HOST), index.pooled_sftp("op2", SAME_HOST):
+        pass
+
+    assert len(handshakes) == 1
+    assert len(handshakes[0].sessions) == 2
+
+
+def test_each_worker_gets_its_own_connection(handshakes):
+    with index.pooled_sftp("op1", SAME_HOST) as first, index.pooled_sftp("op1", SAME_HOST) as second:
+        assert first is not second
+
+    assert len(handshakes) == 2
+
+
+def test_locations_on_different_endpoints_dont_share(handshakes):
+    with index.pooled_sftp("op1", TWO_HOSTS), index.pooled_sftp("op2", TWO_HOSTS):
+        pass
+
+    assert len(handshakes) == 2
+
+
+def test_returned_sessions_are_reused(handshakes):
+    with index.pooled_sftp("op1", SAME_HOST) as first:
+        pass
+    with index.pooled_sftp("op1", SAME_HOST) as second:
+        pass
+
+    assert second is first
+    assert len(handshakes) == 1
+
+
+def test_second_location_waits_for_the_handshake_in_progress(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    clients = []
+
+    def slow_connect_ssh(host, port):
+        clients.append(FakeClient())
+        started.set()
+        release.wait(timeout=5)
+        return clients[-1]
+
+    monkeypatch.setattr(index, "connect_ssh", slow_connect_ssh)
+
+    def check_out(location):
+        with index.pooled_sftp(location, SAME_HOST):
+            pass
+
+    first = threading.Thread(target=check_out, args=("op1",))
+    first.start()
+    started.wait(timeout=5)
+    second = threading.Thread(target=check_out, args=("op2",))
+    second.start()
+    release.set()
+    first.join(timeout=5)
+    second.join(timeout=5)
+
+    assert len(clients) == 1
+    assert len(clients[0].sessions) == 2
+
+
+def test_failed_handshake_is_not_pooled(monkeypatch, handshakes):
+    def refused(host, port):
+        raise OSError("refused")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(index, "connect_ssh", refused)
+        with pytest.raises(OSError):
+            with index.pooled_sftp("op1", SAME_HOST):
+                pass
+
+    assert index._SSH_CONNECTIONS[("sftp", 22)] == []
+
+    with index.pooled_sftp("op1", SAME_HOST):
+        pass
+    assert len(handshakes) == 1
+
+
+def test_session_that_failed_in_use_is_discarded(handshakes):
+    with pytest.raises(IOError):
+        with index.pooled_sftp("op1", SAME_HOST) as sftp:
+            raise IOError("write failed")
+
+    assert sftp.closed
+    assert not handshakes[0].transport.active
+    assert index._SFTP_POOL[("op1", "sftp", 22)] == []
+
+
+def test_stale_idle_session_is_probed_and_replaced(handshakes):
+    with index.pooled_sftp("op1", SAME_HOST) as op1_session, index.pooled_sftp("op2", SAME_HOST):
+        pass
+
+    # A TCP connection dropped while the container was frozen still looks open
+    op1_session.stale = True
+    for key, idle in index._SFTP_POOL.items():
+        idle[:] = [(connection, sftp, idle_since - 600) for connection, sftp, idle_since in idle]
+
+    with index.pooled_sftp("op1", SAME_HOST) as replacement:
+        assert replacement is not op1_session
+    assert ("normalize", ".") in op1_session.calls
+    assert len(handshakes) == 2
+
+    # The other location's session shared the dropped connection, so it is not reused either
+    with index.pooled_sftp("op2", SAME_HOST) as op2_session:
+        assert op2_session in handshakes[1].sessions
+    assert len(handshakes) == 2
+    assert not handshakes[0].transport.active
+
+
+def test_recently_returned_session_is_not_probed(handshakes):
+    with index.pooled_sftp("op1", SAME_HOST) as sftp:
+        pass
+    with index.pooled_sftp("op1", SAME_HOST):
+        pass
+
+    assert ("normalize", ".") not in sftp.calls
+
+
+def test_warm_up_probes_each_location(handshakes):
+    index.open_onprem_connections(SAME_HOST)
+
+    assert len(handshakes) == 1
+    assert all(("normalize", ".") in sftp.calls for sftp in handshakes[0].sessions)
+
+
+# Remote directories
+
+def test_create_remote_directory_creates_missing_levels():
+    sftp = FakeSFTP(dirs={"/", "/From_AWS"})
+    index.create_remote_directory(sftp, "/From_AWS/2026/10/14/05", "op1")
+
+    assert {"/From_AWS/2026", "/From_AWS/2026/10", "/From_AWS/2026/10/14", "/From_AWS/2026/10/14/05"} <= sftp.dirs
+    assert ("op1", "/From_AWS/2026/10/14/05") in index._DIR_CACHE
+
+
+def test_create_remote_directory_new_hour_is_one_round_trip():
+    sftp = FakeSFTP(dirs={"/", "/From_AWS"})
+    index.create_remote_directory(sftp, "/From_AWS/2026/10/14/05", "op1")
+    sftp.calls.clear()
+
+    index.create_remote_directory(sftp, "/From_AWS/2026/10/14/06", "op1")
+
+    assert sftp.calls == [("mkdir", "/From_AWS/2026/10/14/06")]
+
+
+def test_create_remote_directory_existing_directory():
+    sftp = FakeSFTP(dirs={"/", "/From_AWS", "/From_AWS/2026"})
+    index.create_remote_directory(sftp, "/From_AWS/2026", "op2")
+
+    assert sftp.calls == [("mkdir", "/From_AWS/2026"), ("stat", "/From_AWS/2026")]
+    assert ("op2", "/From_AWS/2026") in index._DIR_CACHE
+
+
+# Handler
+
+@pytest.fixture
+def handler(monkeypatch):
+    """lambda_handler with on-premises access and metrics stubbed out"""
+    monkeypatch.setattr(index, "get_onprem_credentials", lambda: SAME_HOST)
+    monkeypatch.setattr(index, "open_onprem_connections", lambda credentials: None)
+    monkeypatch.setattr(index, "send_metrics", lambda cloudwatch, metrics: None)
+    return index.lambda_handler
+
+
+def s3_record(key):
+    return {
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "s3": {"bucket": {"name": "s3-trusted-bucket"}, "object": {"key": key}}
+    }
+
+
+def sqs_message(message_id, body):
+    return {"messageId": message_id, "body": body}
+
+
+def test_sqs_failures_are_reported_per_message(monkeypatch, handler):
+    monkeypatch.setattr(index, "process_s3_event",
+        lambda record, s3_client, file_stats, credentials, remote_dir: record["s3"]["object"]["key"] != "bad.csv"
+    )
+    event = {"Records": [
+        sqs_message("ok", json.dumps({"Records": [s3_record("good.csv")]})),
+        sqs_message("failed", json.dumps({"Records": [s3_record("bad.csv")]})),
+        sqs_message("mixed", json.dumps({"Records": [s3_record("good.csv"), s3_record("bad.csv")]})),
+    ]}
+
+    response = handler(event, None)
+
+    assert response["batchItemFailures"] == [{"itemIdentifier": "failed"}, {"itemIdentifier": "mixed"}]
+
+
+@pytest.mark.parametrize("body", ["not json", "[1, 2]", '"text"', "42", "null"])
+def test_sqs_bodies_that_arent_objects_are_failures(monkeypatch, handler, body):
+    monkeypatch.setattr(index, "process_s3_event",
+        lambda record, s3_client, file_stats, credentials, remote_dir: True
+    )
+    event = {"Records": [
+        sqs_message("ok", json.dumps({"Records": [s3_record("good.csv")]})),
+        sqs_message("broken", body),
+    ]}
+
+    response = handler(event, None)
+
+    assert response["batchItemFailures"] == [{"itemIdentifier": "broken"}]
+    assert json.loads(response["body"])["successful_files"] == 1
+
+
+def test_records_not_started_before_the_deadline_are_failures(monkeypatch):
+    started = []
+    monkeypatch.setattr(index, "process_s3_event",
+        lambda record, s3_client, file_stats, credentials, remote_dir: started.append(record) or True
+    )
+    context = FakeContext((index.RECORD_DEADLINE_MARGIN_SECONDS - 1) * 1000)
+
+    results = index.process_s3_records([s3_record("a.csv"), s3_record("b.csv")], SAME_HOST, [], "/From_AWS", context)
+
+    assert results == [False, False]
+    assert started == []
+
+
+class FakeS3:
+    def __init__(self):
+        self.keys = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.keys.append(Key)
+
+
+def direct_event(key="2026/10/14/05/file.csv"):
+    return {"direct_transfer": {"key": key, "body": base64.b64encode(b"lat,lon").decode("ascii")}}
+
+
+@pytest.mark.parametrize("reached, delivered, archived", [
+    ({"op1", "op2"}, ["op1", "op2"], True),
+    ({"op1"}, ["op1"], False),
+    (set(), [], False),
+])
+def test_direct_transfer_reports_delivered_locations(monkeypatch, handler, reached, delivered, archived):
+    s3 = FakeS3()
+    monkeypatch.setattr(index, "S3", s3)
+    monkeypatch.setattr(index, "transfer_file_to_onprem",
+        lambda remote_dir, file_name, file_obj, credentials, location: location in reached
+    )
+
+    body = json.loads(handler(direct_event(), None)["body"])
+
+    assert body["delivered_locations"] == delivered
+    assert body["successful_files"] == int(len(delivered) == 2)
+    assert bool(s3.keys) == archived
+
+
+def test_direct_transfer_without_credentials_delivered_nothing(monkeypatch):
+    def unavailable():
+        raise RuntimeError("Secrets Manager unavailable")
+
+    monkeypatch.setattr(index, "get_onprem_credentials", unavailable)
+
+    response = index.lambda_handler(direct_event(), None)
+
+    assert json.loads(response["body"])["delivered_locations"] == []
+    with pytest.raises(RuntimeError):
+        index.lambda_handler({"Records": []}, None)
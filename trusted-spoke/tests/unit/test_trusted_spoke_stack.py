@@ -1,15 +1,61 @@
+import json
+import os
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
+
+from trusted_spoke.trusted_spoke_stack import TrustedSpokeStack, layer_code
+
+PROJECT_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+def synth(**context):
+    """Template for the stack as `cdk synth` builds it, with the cached VPC lookup and feature flags"""
+    with open(os.path.join(PROJECT_DIR, "cdk.json")) as f:
+        app_context = json.load(f)["context"]
+    with open(os.path.join(PROJECT_DIR, "cdk.context.json")) as f:
+        app_context.update(json.load(f))
+    app_context.update(context)
+
+    app = core.App(context=app_context)
+    stack = TrustedSpokeStack(app, "trusted-spoke",
+        untrusted_account_id="506294024506",
+        env=core.Environment(account="746669204818", region="il-central-1")
+    )
+    return assertions.Template.from_stack(stack)
+
+
+@pytest.fixture(autouse=True)
+def project_dir(monkeypatch):
+    # Asset paths in the stack are relative to the CDK app
+    monkeypatch.chdir(PROJECT_DIR)
 
-from trusted_spoke.trusted_spoke_stack import TrustedSpokeStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in trusted_spoke/trusted_spoke_stack.py
 def test_sqs_queue_created():
-    app = core.App()
-    stack = TrustedSpokeStack(app, "trusted-spoke")
-    template = assertions.Template.from_stack(stack)
+    template = synth()
+
+    # Six 5 minute function timeouts plus the 30 second batching window
+    template.has_resource_properties("AWS::SQS::Queue", {
+        "VisibilityTimeout": 1830
+    })
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 100,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"]
+    })
+
+
+def test_vpc_endpoints_owned_by_trusted_stack():
+    synth().resource_count_is("AWS::EC2::VPCEndpoint", 3)
+
+
+def test_vpc_endpoints_can_be_skipped():
+    synth(create_vpc_endpoints="false").resource_count_is("AWS::EC2::VPCEndpoint", 0)
+
+
+def test_layer_code_requires_sidecar(tmp_path):
+    layer_zip = tmp_path / "layer.zip"
+    layer_zip.write_bytes(b"")
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+    with pytest.raises(FileNotFoundError):
+        layer_code(str(layer_zip))
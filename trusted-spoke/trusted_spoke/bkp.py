@@ -4,18 +4,17 @@ from aws_cdk import (
     RemovalPolicy,
     aws_lambda as lambda_,
     aws_s3 as s3,
-    aws_s3_notifications as s3n,
     aws_iam as iam,
     aws_ec2 as ec2,
-    aws_sqs as sqs,
     aws_logs as logs,
-    Size,
     Tags,
     CustomResource,
     custom_resources as cr
 )
 from constructs import Construct
 
+from trusted_spoke.trusted_spoke_stack import LAMBDA_CODE_EXCLUDE, LOGS_ACTIONS, ENI_ACTIONS, layer_code
+
 class TrustedSpokeStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, untrusted_account_id: str, **kwargs) -> None:
@@ -26,6 +25,8 @@ class TrustedSpokeStack(Stack):
             vpc_name="sky-vpc"
         )
         
+        lambda_subnets = ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS)
+        
         # Create a security group for the Lambda function
         lambda_sg = ec2.SecurityGroup(self, "TransferLambdaSG",
             vpc=vpc,
@@ -72,148 +73,105 @@ class TrustedSpokeStack(Stack):
             )
         )
         
-        # Create SQS Queue for notifications
-        notification_queue = sqs.Queue(self, "NotificationQueue",
-            queue_name="transfer-notification-queue",
-            visibility_timeout=Duration.seconds(300)
-        )
-        # Add S3 permission to SQS queue policy (IMPORTANT FIX)
-        notification_queue.add_to_resource_policy(
-            iam.PolicyStatement(
-                sid="AllowS3ToSendMessages",
-                effect=iam.Effect.ALLOW,
-                principals=[iam.ServicePrincipal("s3.amazonaws.com")],
-                actions=["sqs:SendMessage"],
-                resources=[notification_queue.queue_arn],
-                conditions={
-                    "ArnLike": {
-                        "aws:SourceArn": trusted_bucket.bucket_arn
-                    }
-                }
-            )
-        )        
-        # REMOVED: This line was causing the error
-        # trusted_bucket.add_event_notification(
-        #    s3.EventType.OBJECT_CREATED,
-        #    s3n.SqsDestination(notification_queue)
-        # )
-        
         # Create Lambda execution role
         lambda_role = iam.Role(self, "TransferLambdaRole",
             role_name="Transfer-Lambda-Role",
             assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
         )
         
-        # Add CloudWatch Logs permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "logs:CreateLogGroup",
-                "logs:CreateLogStream",
-                "logs:PutLogEvents"
-            ],
-            resources=["arn:aws:logs:*:*:*"]
-        ))
-        
-        # Add CloudWatch Metrics permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "cloudwatch:PutMetricData"
-            ],
-            resources=["*"]
-        ))
-        
-        # Add S3 bucket access permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "s3:GetObject",
-                "s3:PutObject",
-                "s3:ListBucket",
-                "s3:DeleteObject"
-            ],
-            resources=[
-                trusted_bucket.bucket_arn,
-                f"{trusted_bucket.bucket_arn}/*"
-            ]
-        ))
-        
-        # Add VPC access permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "ec2:CreateNetworkInterface",
-                "ec2:DescribeNetworkInterfaces",
-                "ec2:DeleteNetworkInterface"
-            ],
-            resources=["*"]
-        ))
-        
-        # Add SQS permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "sqs:ReceiveMessage",
-                "sqs:DeleteMessage",
-                "sqs:GetQueueAttributes"
-            ],
-            resources=[notification_queue.queue_arn]
-        ))
-        
-        # Create Secret access for on-prem credentials (fixing the name)
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=["secretsmanager:GetSecretValue"],
-            resources=[f"arn:aws:secretsmanager:{self.region}:{self.account}:secret:onprem-credentials*"]
-        ))
+        # Grant the Lambda its permissions through a single inline policy
+        lambda_policy = iam.Policy(self, "LambdaPolicy",
+            roles=[lambda_role],
+            document=iam.PolicyDocument(statements=[
+                # Add CloudWatch Logs permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=list(LOGS_ACTIONS),
+                    resources=["arn:aws:logs:*:*:*"]
+                ),
+                # Add S3 bucket access permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "s3:GetObject",
+                        "s3:PutObject",
+                        "s3:ListBucket",
+                        "s3:DeleteObject"
+                    ],
+                    resources=[
+                        trusted_bucket.bucket_arn,
+                        f"{trusted_bucket.bucket_arn}/*"
+                    ]
+                ),
+                # Add CloudWatch Metrics and VPC access permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["cloudwatch:PutMetricData", *ENI_ACTIONS],
+                    resources=["*"]
+                ),
+                # Create Secret access for on-prem credentials (fixing the name)
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["secretsmanager:GetSecretValue"],
+                    resources=[f"arn:aws:secretsmanager:{self.region}:{self.account}:secret:onprem-credentials*"]
+                )
+            ])
+        )
         
         # Creating Lambda layer for dependencies
         dependencies_layer = lambda_.LayerVersion(self, "TransferDependenciesLayer",
             layer_version_name="transfer-dependencies",
-            code=lambda_.Code.from_asset("./lambda/layers/transfer-dependencies/python/transfer-dependencies.zip"),
-            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
-            description="Dependencies for Transfer Lambda: requests, paramiko"
+            code=layer_code("./lambda/layers/transfer-dependencies/python/transfer-dependencies.zip"),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_12],
+            compatible_architectures=[lambda_.Architecture.ARM_64],
+            description="Dependencies for Transfer Lambda: paramiko"
+        )
+        
+        # Configure CloudWatch Logs retention; the function logs here directly, so the
+        # group exists before the first invocation instead of racing Lambda's auto-created one
+        transfer_log_group = logs.LogGroup(
+            self, 
+            "TransferLambdaLogGroup",
+            log_group_name="/aws/lambda/s3-transfer",
+            retention=logs.RetentionDays.SIX_MONTHS
         )
         
         # Create Lambda function
         transfer_lambda = lambda_.Function(self, "TransferFunction",
             function_name="s3-transfer",
-            runtime=lambda_.Runtime.PYTHON_3_9,
-            code=lambda_.Code.from_asset("./lambda"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            architecture=lambda_.Architecture.ARM_64,
+            code=lambda_.Code.from_asset("./lambda", exclude=LAMBDA_CODE_EXCLUDE),
             handler="index.lambda_handler",
             timeout=Duration.minutes(5),
-            memory_size=2048,
-            ephemeral_storage_size=Size.mebibytes(4096),
+            # 1769 MB is one full vCPU; S3 streams plateau around 45-58 MB/s per stream,
+            # so memory beyond this only adds GB-seconds without adding throughput
+            memory_size=1769,
             environment={
                 "TRUSTED_BUCKET": trusted_bucket.bucket_name,
                 "ONPREM_SECRET_NAME": "onprem-credentials"
             },
             vpc=vpc,
-            vpc_subnets=ec2.SubnetSelection(
-                subnet_type=ec2.SubnetType.PRIVATE_WITH_NAT
-            ),
+            vpc_subnets=lambda_subnets,
             security_groups=[lambda_sg],
             role=lambda_role,
-            layers=[dependencies_layer]
+            layers=[dependencies_layer],
+            log_group=transfer_log_group
         )
         
-        # Configure CloudWatch Logs retention
-        logs.LogGroup(
-            self, 
-            "TransferLambdaLogGroup",
-            log_group_name=f"/aws/lambda/{transfer_lambda.function_name}",
-            retention=logs.RetentionDays.SIX_MONTHS
-        )
+        # The VPC config is validated at creation, so the ENI permissions must already be attached
+        transfer_lambda.node.add_dependency(lambda_policy)
         
-        # Set up SQS as event source for Lambda
-        transfer_lambda.add_event_source_mapping("SQSTrigger",
-            event_source_arn=notification_queue.queue_arn,
-            batch_size=10,
-            max_batching_window=Duration.minutes(5)
+        # Allow S3 to invoke the function directly, without an SQS envelope to decode
+        transfer_lambda.add_permission("S3Invoke",
+            principal=iam.ServicePrincipal("s3.amazonaws.com"),
+            source_arn=trusted_bucket.bucket_arn,
+            source_account=self.account
         )
         
         # ADDED SECTION START - Custom Resource for S3 Bucket Notification
+        # Only this backup variant invokes the function straight from S3; the deployed
+        # TrustedSpokeStack keeps the SQS queue for per-message batch failure reporting
         # Create security group for notification handler
         notification_handler_sg = ec2.SecurityGroup(self, "NotificationHandlerSG",
             vpc=vpc,
@@ -229,11 +187,7 @@ class TrustedSpokeStack(Stack):
         # Add required permissions for the notification handler
         notification_handler_role.add_to_policy(iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
-            actions=[
-                "logs:CreateLogGroup",
-                "logs:CreateLogStream",
-                "logs:PutLogEvents"
-            ],
+            actions=list(LOGS_ACTIONS),
             resources=["arn:aws:logs:*:*:*"]
         ))
         
@@ -250,17 +204,14 @@ class TrustedSpokeStack(Stack):
         # Add VPC access permissions
         notification_handler_role.add_to_policy(iam.PolicyStatement(
             effect=iam.Effect.ALLOW,
-            actions=[
-                "ec2:CreateNetworkInterface",
-                "ec2:DescribeNetworkInterfaces",
-                "ec2:DeleteNetworkInterface"
-            ],
+            actions=list(ENI_ACTIONS),
             resources=["*"]
         ))
         
         # Create notification handler Lambda function
         notification_handler = lambda_.Function(self, "S3NotificationHandler",
-            runtime=lambda_.Runtime.PYTHON_3_9,
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            architecture=lambda_.Architecture.ARM_64,
             code=lambda_.Code.from_inline("""
 import json
 import boto3
@@ -276,8 +227,7 @@ def handler(event, context):
     # Extract properties from the event
     properties = event['ResourceProperties']
     bucket_name = properties['BucketName']
-    queue_url = properties['QueueUrl']
-    queue_arn = properties['QueueArn']
+    function_arn = properties['FunctionArn']
     events = properties.get('Events', 's3:ObjectCreated:*').split(',')
     
     response_data = {}
@@ -294,29 +244,29 @@ def handler(event, context):
             if 'ResponseMetadata' in existing_config:
                 existing_config.pop('ResponseMetadata')
             
-            # Prepare the new queue configuration
-            queue_config = {
-                'QueueArn': queue_arn,
+            # Prepare the new function configuration
+            function_config = {
+                'LambdaFunctionArn': function_arn,
                 'Events': events
             }
             
-            # Add or update the queue configurations
-            queue_configurations = existing_config.get('QueueConfigurations', [])
+            # Add or update the function configurations
+            function_configurations = existing_config.get('LambdaFunctionConfigurations', [])
             
-            # Check if a configuration for this queue already exists
+            # Check if a configuration for this function already exists
             updated = False
-            for i, config in enumerate(queue_configurations):
-                if config.get('QueueArn') == queue_arn:
-                    queue_configurations[i] = queue_config
+            for i, config in enumerate(function_configurations):
+                if config.get('LambdaFunctionArn') == function_arn:
+                    function_configurations[i] = function_config
                     updated = True
                     break
             
             if not updated:
-                queue_configurations.append(queue_config)
+                function_configurations.append(function_config)
                 
             # Update the full notification configuration
             notification_config = existing_config
-            notification_config['QueueConfigurations'] = queue_configurations
+            notification_config['LambdaFunctionConfigurations'] = function_configurations
             
             # Put the updated notification configuration
             logger.info('Putting bucket notification: %s', json.dumps(notification_config))
@@ -335,19 +285,19 @@ def handler(event, context):
             if 'ResponseMetadata' in existing_config:
                 existing_config.pop('ResponseMetadata')
             
-            # Remove the queue configuration for this queue
-            queue_configurations = existing_config.get('QueueConfigurations', [])
-            queue_configurations = [
-                config for config in queue_configurations 
-                if config.get('QueueArn') != queue_arn
+            # Remove the function configuration for this function
+            function_configurations = existing_config.get('LambdaFunctionConfigurations', [])
+            function_configurations = [
+                config for config in function_configurations 
+                if config.get('LambdaFunctionArn') != function_arn
             ]
             
             # Update the full notification configuration
             notification_config = existing_config
-            if queue_configurations:
-                notification_config['QueueConfigurations'] = queue_configurations
+            if function_configurations:
+                notification_config['LambdaFunctionConfigurations'] = function_configurations
             else:
-                notification_config.pop('QueueConfigurations', None)
+                notification_config.pop('LambdaFunctionConfigurations', None)
             
             # Put the updated notification configuration
             logger.info('Putting bucket notification: %s', json.dumps(notification_config))
@@ -368,9 +318,7 @@ def handler(event, context):
             handler="index.handler",
             timeout=Duration.seconds(300),
             vpc=vpc,
-            vpc_subnets=ec2.SubnetSelection(
-                subnet_type=ec2.SubnetType.PRIVATE_WITH_NAT
-            ),
+            vpc_subnets=lambda_subnets,
             security_groups=[notification_handler_sg],
             role=notification_handler_role
         )
@@ -385,26 +333,14 @@ def handler(event, context):
             service_token=notification_provider.service_token,
             properties={
                 "BucketName": trusted_bucket.bucket_name,
-                "QueueUrl": notification_queue.queue_url,
-                "QueueArn": notification_queue.queue_arn,
+                "FunctionArn": transfer_lambda.function_arn,
                 "Events": "s3:ObjectCreated:*"
             }
         )
+        # S3 validates the destination when the notification is put, so the invoke permission must exist first
+        s3_notification_custom_resource.node.add_dependency(transfer_lambda.node.find_child("S3Invoke"))
         # ADDED SECTION END
         
-        # Add tags to resources
-        all_resources = [
-            trusted_bucket,
-            notification_queue,
-            lambda_sg,
-            lambda_role,
-            transfer_lambda,
-            dependencies_layer,
-            notification_handler,
-            notification_handler_sg,
-            notification_handler_role
-        ]
-        
-        for resource in all_resources:
-            Tags.of(resource).add("Project", "TransferSystem")
-            Tags.of(resource).add("Environment", "trusted")
\ No newline at end of file
+        # Tag every taggable resource in the stack
+        Tags.of(self).add("Project", "TransferSystem")
+        Tags.of(self).add("Environment", "trusted")
\ No newline at end of file
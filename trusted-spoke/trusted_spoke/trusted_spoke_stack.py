@@ -1,3 +1,4 @@
+import os
 from aws_cdk import (
     Duration,
     Stack,
@@ -9,14 +10,37 @@ from aws_cdk import (
     aws_ec2 as ec2,
     aws_sqs as sqs,
     aws_logs as logs,
-    Size,
+    aws_secretsmanager as secretsmanager,
+    AssetHashType,
+    SecretValue,
     Tags
 )
 from constructs import Construct
 
+# IAM actions shared by the Lambda policies, built once at import. The two spokes are separate CDK
+# apps with no shared package, so these and layer_code below are also defined in
+# untrusted-spoke/untrusted_spoke/untrusted_spoke_stack.py; change both copies together
+LOGS_ACTIONS = ("logs:CreateLogGroup", "logs:CreateLogStream", "logs:PutLogEvents")
+ENI_ACTIONS = ("ec2:CreateNetworkInterface", "ec2:DescribeNetworkInterfaces", "ec2:DeleteNetworkInterface")
+SQS_ACTIONS = ("sqs:ReceiveMessage", "sqs:DeleteMessage", "sqs:GetQueueAttributes")
+
+# Only the handler is function code; layers and helper scripts stay out of the asset
+LAMBDA_CODE_EXCLUDE = ["layers", "*.sh", "__pycache__", "*.pyc", "tests", ".venv"]
+
+def layer_code(path: str) -> lambda_.Code:
+    """Layer code hashed from the zip's .sha256 sidecar instead of re-hashing the zip on every synth"""
+    sidecar = f"{path}.sha256"
+    # A zip without its sidecar means the step that writes it was skipped, so fail the synth
+    # instead of quietly hashing the whole zip again
+    if not os.path.exists(sidecar):
+        raise FileNotFoundError(f"Missing {sidecar}; regenerate it with: sha256sum {path} > {sidecar}")
+    with open(sidecar) as f:
+        asset_hash = f.read().split()[0]
+    return lambda_.Code.from_asset(path, asset_hash=asset_hash, asset_hash_type=AssetHashType.CUSTOM)
+
 class TrustedSpokeStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, untrusted_account_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, untrusted_account_id: str, create_onprem_secret: bool = False, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         # Use existing VPC
@@ -24,6 +48,26 @@ class TrustedSpokeStack(Stack):
             vpc_name="sky-vpc"
         )
         
+        # Keep AWS API traffic off the NAT gateway: S3 through a gateway endpoint,
+        # Secrets Manager and CloudWatch metrics through interface endpoints.
+        # sky-vpc is shared with the untrusted spoke and takes only one S3 route and one private
+        # DNS name per service, so this stack owns the endpoints for both spokes; deploy with
+        # -c create_vpc_endpoints=false if they already exist in the VPC
+        lambda_subnets = ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS)
+        if str(self.node.try_get_context("create_vpc_endpoints")).lower() != "false":
+            vpc.add_gateway_endpoint("S3Endpoint",
+                service=ec2.GatewayVpcEndpointAwsService.S3,
+                subnets=[lambda_subnets]
+            )
+            vpc.add_interface_endpoint("SecretsManagerEndpoint",
+                service=ec2.InterfaceVpcEndpointAwsService.SECRETS_MANAGER,
+                subnets=lambda_subnets
+            )
+            vpc.add_interface_endpoint("CloudWatchMetricsEndpoint",
+                service=ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_MONITORING,
+                subnets=lambda_subnets
+            )
+        
         # Create a security group for the Lambda function
         lambda_sg = ec2.SecurityGroup(self, "TransferLambdaSG",
             vpc=vpc,
@@ -48,6 +92,17 @@ class TrustedSpokeStack(Stack):
                         )
                     ],
                     enabled=True
+                ),
+                # Overwritten and deleted objects stay recoverable for 90 days, archived in the meantime
+                s3.LifecycleRule(
+                    noncurrent_version_transitions=[
+                        s3.NoncurrentVersionTransition(
+                            storage_class=s3.StorageClass.DEEP_ARCHIVE,
+                            transition_after=Duration.days(1)
+                        )
+                    ],
+                    noncurrent_version_expiration=Duration.days(90),
+                    enabled=True
                 )
             ]
         )
@@ -70,10 +125,12 @@ class TrustedSpokeStack(Stack):
             )
         )
         
-        # Create SQS Queue for notifications
+        # Create SQS Queue for notifications. Lambda's guidance for SQS sources is a visibility timeout of
+        # six times the function timeout (5 minutes) plus the batching window (30 seconds), so messages
+        # aren't redelivered to a second invocation while throttled batches are still being retried
         notification_queue = sqs.Queue(self, "NotificationQueue",
             queue_name="transfer-notification-queue",
-            visibility_timeout=Duration.seconds(300)
+            visibility_timeout=Duration.seconds(6 * 300 + 30)
         )
         
         # Set up S3 event notifications to SQS
@@ -82,131 +139,131 @@ class TrustedSpokeStack(Stack):
             s3n.SqsDestination(notification_queue)
         )
         
+        # Create on-premises credentials secret, unless it is provisioned with lambda/create_secrets.sh
+        onprem_secret = None
+        if create_onprem_secret:
+            onprem_secret = secretsmanager.Secret(self, "OnPremCredentials",
+                secret_name="onprem-credentials",
+                description="Credentials for on-premises SFTP destinations",
+                # Hosts and ports aren't sensitive, so they are set directly instead of generated
+                secret_object_value={
+                    "op1_host": SecretValue.unsafe_plain_text("matmar.op.sky320.internal"),
+                    "op1_port": SecretValue.unsafe_plain_text("443"),
+                    "op2_host": SecretValue.unsafe_plain_text("matmar2.op.sky320.internal"),
+                    "op2_port": SecretValue.unsafe_plain_text("443")
+                }
+            )
+        
         # Create Lambda execution role
         lambda_role = iam.Role(self, "TransferLambdaRole",
             role_name="Transfer-Lambda-Role",
             assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
         )
         
-        # Add CloudWatch Logs permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "logs:CreateLogGroup",
-                "logs:CreateLogStream",
-                "logs:PutLogEvents"
-            ],
-            resources=["arn:aws:logs:*:*:*"]
-        ))
-        
-        # Add CloudWatch Metrics permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "cloudwatch:PutMetricData"
-            ],
-            resources=["*"]
-        ))
-        
-        # Add S3 bucket access permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "s3:GetObject",
-                "s3:PutObject",
-                "s3:ListBucket",
-                "s3:DeleteObject"
-            ],
-            resources=[
-                trusted_bucket.bucket_arn,
-                f"{trusted_bucket.bucket_arn}/*"
-            ]
-        ))
-        
-        # Add VPC access permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "ec2:CreateNetworkInterface",
-                "ec2:DescribeNetworkInterfaces",
-                "ec2:DeleteNetworkInterface"
-            ],
-            resources=["*"]
-        ))
-        
-        # Add SQS permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "sqs:ReceiveMessage",
-                "sqs:DeleteMessage",
-                "sqs:GetQueueAttributes"
-            ],
-            resources=[notification_queue.queue_arn]
-        ))
-        
-        # Create Secret access for on-prem credentials (fixing the name)
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=["secretsmanager:GetSecretValue"],
-            resources=[f"arn:aws:secretsmanager:{self.region}:{self.account}:secret:onprem-credentials*"]
-        ))
+        # Grant the Lambda its permissions through a single inline policy
+        lambda_policy = iam.Policy(self, "LambdaPolicy",
+            roles=[lambda_role],
+            document=iam.PolicyDocument(statements=[
+                # Add CloudWatch Logs permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=list(LOGS_ACTIONS),
+                    resources=["arn:aws:logs:*:*:*"]
+                ),
+                # Add S3 bucket access permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "s3:GetObject",
+                        "s3:PutObject",
+                        "s3:ListBucket",
+                        "s3:DeleteObject"
+                    ],
+                    resources=[
+                        trusted_bucket.bucket_arn,
+                        f"{trusted_bucket.bucket_arn}/*"
+                    ]
+                ),
+                # Add CloudWatch Metrics and VPC access permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["cloudwatch:PutMetricData", *ENI_ACTIONS],
+                    resources=["*"]
+                ),
+                # Add SQS permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=list(SQS_ACTIONS),
+                    resources=[notification_queue.queue_arn]
+                ),
+                # Create Secret access for on-prem credentials (fixing the name)
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["secretsmanager:GetSecretValue"],
+                    resources=[onprem_secret.secret_arn if onprem_secret else f"arn:aws:secretsmanager:{self.region}:{self.account}:secret:onprem-credentials*"]
+                )
+            ])
+        )
         
         # Creating Lambda layer for dependencies
         dependencies_layer = lambda_.LayerVersion(self, "TransferDependenciesLayer",
             layer_version_name="transfer-dependencies",
-            code=lambda_.Code.from_asset("./lambda/layers/transfer-dependencies/python/transfer-dependencies.zip"),
-            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
-            description="Dependencies for Transfer Lambda: requests, paramiko"
+            code=layer_code("./lambda/layers/transfer-dependencies/python/transfer-dependencies.zip"),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_12],
+            compatible_architectures=[lambda_.Architecture.ARM_64],
+            description="Dependencies for Transfer Lambda: paramiko"
+        )
+        
+        # Configure CloudWatch Logs retention; the function logs here directly, so the
+        # group exists before the first invocation instead of racing Lambda's auto-created one
+        transfer_log_group = logs.LogGroup(
+            self, 
+            "TransferLambdaLogGroup",
+            log_group_name="/aws/lambda/s3-transfer",
+            retention=logs.RetentionDays.SIX_MONTHS
         )
         
         # Create Lambda function
         transfer_lambda = lambda_.Function(self, "TransferFunction",
             function_name="s3-transfer",
-            runtime=lambda_.Runtime.PYTHON_3_9,
-            code=lambda_.Code.from_asset("./lambda"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            architecture=lambda_.Architecture.ARM_64,
+            code=lambda_.Code.from_asset("./lambda", exclude=LAMBDA_CODE_EXCLUDE),
             handler="index.lambda_handler",
             timeout=Duration.minutes(5),
-            memory_size=2048,
-            ephemeral_storage_size=Size.mebibytes(4096),
+            # 1769 MB is one full vCPU; S3 streams plateau around 45-58 MB/s per stream,
+            # so memory beyond this only adds GB-seconds without adding throughput
+            memory_size=1769,
             environment={
                 "TRUSTED_BUCKET": trusted_bucket.bucket_name,
-                "ONPREM_SECRET_NAME": "onprem-credentials"
+                "ONPREM_SECRET_NAME": onprem_secret.secret_name if onprem_secret else "onprem-credentials"
             },
             vpc=vpc,
-            vpc_subnets=ec2.SubnetSelection(
-                subnet_type=ec2.SubnetType.PRIVATE_WITH_NAT
-            ),
+            vpc_subnets=lambda_subnets,
             security_groups=[lambda_sg],
             role=lambda_role,
-            layers=[dependencies_layer]
+            layers=[dependencies_layer],
+            log_group=transfer_log_group
         )
         
-        # Configure CloudWatch Logs retention
-        logs.LogGroup(
-            self, 
-            "TransferLambdaLogGroup",
-            log_group_name=f"/aws/lambda/{transfer_lambda.function_name}",
-            retention=logs.RetentionDays.SIX_MONTHS
+        # The VPC config is validated at creation, so the ENI permissions must already be attached
+        transfer_lambda.node.add_dependency(lambda_policy)
+        
+        # Let the untrusted spoke hand small files over by direct invocation
+        transfer_lambda.add_permission("UntrustedSpokeInvoke",
+            principal=iam.AccountPrincipal(untrusted_account_id)
         )
         
-        # Set up SQS as event source for Lambda
+        # Set up SQS as event source for Lambda; failed messages are reported individually
+        # so a large batch doesn't have to be retried as a whole. A batch that can't finish within
+        # the timeout still returns: records not started a minute before it are reported as failed
         transfer_lambda.add_event_source_mapping("SQSTrigger",
             event_source_arn=notification_queue.queue_arn,
-            batch_size=10,
-            max_batching_window=Duration.minutes(5)
+            batch_size=100,
+            max_batching_window=Duration.seconds(30),
+            report_batch_item_failures=True
         )
         
-        # Add tags to resources
-        all_resources = [
-            trusted_bucket,
-            notification_queue,
-            lambda_sg,
-            lambda_role,
-            transfer_lambda,
-            dependencies_layer
-        ]
-        
-        for resource in all_resources:
-            Tags.of(resource).add("Project", "TransferSystem")
-            Tags.of(resource).add("Environment", "trusted")
\ No newline at end of file
+        # Tag every taggable resource in the stack
+        Tags.of(self).add("Project", "TransferSystem")
+        Tags.of(self).add("Environment", "trusted")
\ No newline at end of file
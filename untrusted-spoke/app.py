@@ -7,11 +7,14 @@ from untrusted_spoke.untrusted_spoke_stack import UntrustedSpokeStack
 
 
 app = cdk.App()
-UntrustedSpokeStack(app, "UntrustedSpokeStack",
-        env={
-        'account': os.environ.get('CDK_DEFAULT_ACCOUNT', '506294024506'),
-        'region': os.environ.get('CDK_DEFAULT_REGION', 'il-central-1')
-    }   
-    )
+# `-c stacks=A,B` builds only the listed stacks; without it every stack is built
+stacks = app.node.try_get_context("stacks")
+if not stacks or "UntrustedSpokeStack" in stacks.split(","):
+    UntrustedSpokeStack(app, "UntrustedSpokeStack",
+            env={
+            'account': os.environ.get('CDK_DEFAULT_ACCOUNT', '506294024506'),
+            'region': os.environ.get('CDK_DEFAULT_REGION', 'il-central-1')
+        }   
+        )
 
 app.synth()
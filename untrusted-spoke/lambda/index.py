@@ -1,5 +1,6 @@
 import os
 import json
+import base64
 import boto3
 import uuid
 import time
@@ -12,25 +13,63 @@ import csv
 import re
 from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+# Synchronous invocation payloads are capped at 6 MB and base64 grows the body by a third,
+# so files up to 4 MiB are sent inline and larger ones go through the trusted bucket
+DIRECT_TRANSFER_MAX_BYTES = 4 * 1024 * 1024
+
+# Outcomes of a direct transfer. Only a file that reached no on-premises location is resent
+# through the trusted bucket, since that path delivers to every location again
+DIRECT_DELIVERED = 'delivered'
+DIRECT_NOT_DELIVERED = 'not_delivered'
+DIRECT_UNCERTAIN = 'uncertain'
+
+# AWS clients are created once per container and reused by warm invocations
+S3 = boto3.client('s3')
+CW = boto3.client('cloudwatch')
+# The trusted transfer Lambda runs for up to 5 minutes, so its response is awaited for longer than
+# that, and an invoke is never retried: a retry after a timeout could deliver the file twice
+DIRECT_TRANSFER_READ_TIMEOUT = 330
+LAMBDA = boto3.client('lambda', config=Config(
+    connect_timeout=10,
+    read_timeout=DIRECT_TRANSFER_READ_TIMEOUT,
+    retries={'total_max_attempts': 1}
+))
+
+# A file is only handed off directly while the invocation has time to wait out the whole read
+# timeout plus this margin; later files go through the trusted bucket instead
+DIRECT_TRANSFER_DEADLINE_MARGIN_SECONDS = 30
+
+# The GCS client (and the credentials it was built from) is cached in-process to avoid a
+# Secrets Manager query and a new HTTP session per invocation
+CREDENTIALS_TTL_SECONDS = 300
+_SM_CLIENT = boto3.client('secretsmanager')
+_STORAGE_CLIENT_CACHE = {"client": None, "expiry": 0}
+
 def get_current_path():
     """Get current UTC time folder path: yyyy/MM/DD/HH"""
     now = datetime.now(timezone.utc)
     return now.strftime("%Y/%m/%d/%H")
 
 def get_storage_client():
-    """Create a Google Cloud Storage client using credentials from AWS Secrets Manager"""
+    """Get a Google Cloud Storage client using credentials from AWS Secrets Manager, cached for CREDENTIALS_TTL_SECONDS"""
+    if _STORAGE_CLIENT_CACHE["client"] is not None and time.monotonic() < _STORAGE_CLIENT_CACHE["expiry"]:
+        return _STORAGE_CLIENT_CACHE["client"]
+    
     try:
         # Get credentials from AWS Secrets Manager
-        secret_client = boto3.client('secretsmanager')
-        secret_response = secret_client.get_secret_value(
+        secret_response = _SM_CLIENT.get_secret_value(
             SecretId=os.environ['GOOGLE_CREDS_SECRET_NAME']
         )
         credentials_dict = json.loads(secret_response['SecretString'])
         
         # Create storage client directly from service account info
-        return storage.Client.from_service_account_info(credentials_dict)
+        _STORAGE_CLIENT_CACHE["client"] = storage.Client.from_service_account_info(credentials_dict)
+        _STORAGE_CLIENT_CACHE["expiry"] = time.monotonic() + CREDENTIALS_TTL_SECONDS
+        return _STORAGE_CLIENT_CACHE["client"]
     except Exception as e:
         print(f"Error setting up Google Storage client: {str(e)}")
         raise
@@ -154,7 +193,57 @@ def track_batch_processing(cloudwatch, total_files: int, successful_files: int,
 
     put_metrics(cloudwatch, 'MOD/BatchProcessing', metrics)
 
-def process_single_file(blob, s3_client, cloudwatch):
+def track_undelivered_file(cloudwatch, s3_path: str):
+    """Count a valid file that may have reached only some on-premises locations and was not resent"""
+    # No FileName dimension, so a single alarm covers every file
+    put_metrics(cloudwatch, 'MOD/FileProcessing', [{
+        'MetricName': 'UndeliveredFiles',
+        'Value': 1,
+        'Unit': 'Count'
+    }])
+    print(f"File {s3_path} needs a manual redelivery from the untrusted bucket")
+
+def transfer_directly(lambda_client, s3_path: str, body: bytes) -> str:
+    """Hand a small validated file to the trusted transfer Lambda, skipping the trusted bucket"""
+    try:
+        response = lambda_client.invoke(
+            FunctionName=os.environ['TRUSTED_TRANSFER_FUNCTION'],
+            Payload=json.dumps({
+                'direct_transfer': {
+                    'key': s3_path,
+                    'body': base64.b64encode(body).decode('ascii')
+                }
+            })
+        )
+    except (ClientError, ConnectTimeoutError, EndpointConnectionError) as e:
+        # Rejected by the Lambda service (throttled, denied, not found) or never sent
+        print(f"Direct transfer of {s3_path} was not run: {str(e)}")
+        return DIRECT_NOT_DELIVERED
+    except Exception as e:
+        # The request went out but no answer came back; the function may still be running
+        print(f"Direct transfer of {s3_path} has an unknown outcome: {str(e)}")
+        return DIRECT_UNCERTAIN
+    
+    try:
+        payload = response['Payload'].read()
+        if 'FunctionError' in response:
+            # An unhandled error or timeout can happen after a location was written
+            print(f"Direct transfer of {s3_path} failed: {payload}")
+            return DIRECT_UNCERTAIN
+        
+        result = json.loads(json.loads(payload)['body'])
+        if result['successful_files'] == 1:
+            return DIRECT_DELIVERED
+        if not result['delivered_locations']:
+            print(f"Direct transfer of {s3_path} reached no on-premises location")
+            return DIRECT_NOT_DELIVERED
+        print(f"Direct transfer of {s3_path} only reached {', '.join(result['delivered_locations'])}")
+        return DIRECT_UNCERTAIN
+    except Exception as e:
+        print(f"Direct transfer of {s3_path} returned an unreadable response: {str(e)}")
+        return DIRECT_UNCERTAIN
+
+def process_single_file(blob, s3_client, cloudwatch, lambda_client, context=None):
     """Process a single zip file with cleanup and metrics"""
     start_time = time.time()
     temp_dir = os.path.join('/tmp', str(uuid.uuid4()))
@@ -207,6 +296,24 @@ def process_single_file(blob, s3_client, cloudwatch):
                     }
                 )
                 
+                # Small files go straight to the trusted transfer Lambda; larger ones, or
+                # ones it delivered nowhere, go through the trusted bucket and its SQS trigger
+                body = csv_content.encode('utf-8')
+                # A timeout while waiting would kill the rest of the sweep, so near the deadline
+                # the bucket path is used, which returns as soon as the object is written
+                has_time = context is None or context.get_remaining_time_in_millis() > (
+                    DIRECT_TRANSFER_READ_TIMEOUT + DIRECT_TRANSFER_DEADLINE_MARGIN_SECONDS) * 1000
+                if len(body) <= DIRECT_TRANSFER_MAX_BYTES and has_time:
+                    outcome = transfer_directly(lambda_client, s3_path, body)
+                    if outcome == DIRECT_DELIVERED:
+                        return True
+                    if outcome == DIRECT_UNCERTAIN:
+                        # Resending could duplicate the file where it already arrived; the copy
+                        # in the untrusted bucket is left for a manual redelivery, and the
+                        # UndeliveredFiles metric raises an alarm for it
+                        track_undelivered_file(cloudwatch, s3_path)
+                        return False
+                
                 # Upload the CSV to trusted bucket (without "valid" prefix)
                 s3_client.put_object(
                     Bucket=os.environ['TRUSTED_S3_BUCKET'],
@@ -247,10 +354,6 @@ def lambda_handler(event, context):
     batch_start_time = time.time()
     
     try:
-        # Initialize clients
-        s3_client = boto3.client('s3')
-        cloudwatch = boto3.client('cloudwatch')
-        
         # Get Google Storage client
         storage_client = get_storage_client()
         
@@ -267,7 +370,7 @@ def lambda_handler(event, context):
         # Process files concurrently
         with ThreadPoolExecutor(max_workers=4) as executor:
             results = list(executor.map(
-                lambda blob: process_single_file(blob, s3_client, cloudwatch), 
+                lambda blob: process_single_file(blob, S3, CW, LAMBDA, context), 
                 blobs
             ))
         
@@ -276,7 +379,7 @@ def lambda_handler(event, context):
         # Track batch metrics
         batch_duration = time.time() - batch_start_time
         track_batch_processing(
-            cloudwatch,
+            CW,
             len(blobs),
             successful_files,
             total_size,
@@ -299,9 +402,9 @@ def lambda_handler(event, context):
     except Exception as e:
         print(f"Lambda execution failed: {str(e)}")
         # Track metrics even in case of failure
-        if 'cloudwatch' in locals() and 'blobs' in locals():
+        if 'blobs' in locals():
             track_batch_processing(
-                cloudwatch,
+                CW,
                 len(blobs),
                 0,  # No successful files in case of failure
                 0,  # Don't report size in case of failure
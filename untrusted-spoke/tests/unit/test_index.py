@@ -0,0 +1,138 @@
+import importlib.util
+import io
+import json
+import os
+import zipfile
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "il-central-1")
+os.environ.setdefault("TRUSTED_TRANSFER_FUNCTION", "arn:aws:lambda:il-central-1:746669204818:function:transfer")
+os.environ.setdefault("S3_BUCKET_NAME", "s3-untrusted-bucket")
+os.environ.setdefault("TRUSTED_S3_BUCKET", "s3-trusted-bucket")
+
+# lambda/ is not a package, so the handler is loaded from its file
+_spec = importlib.util.spec_from_file_location(
+    "inspection_index", os.path.join(os.path.dirname(__file__), "..", "..", "lambda", "index.py")
+)
+index = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(index)
+
+VALID_CSV = "lat,lon\n32.1,34.8\n"
+
+
+class FakeLambda:
+    """Lambda client answering invoke with a canned response, or raising a canned error"""
+
+    def __init__(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.invocations = 0
+
+    def invoke(self, **kwargs):
+        self.invocations += 1
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+def transfer_response(delivered_locations, function_error=False):
+    if function_error:
+        return {"Payload": io.BytesIO(b'{"errorType": "Sandbox.Timedout"}'), "FunctionError": "Unhandled"}
+    body = {"successful_files": int(len(delivered_locations) == 2), "delivered_locations": delivered_locations}
+    return {"Payload": io.BytesIO(json.dumps({"statusCode": 200, "body": json.dumps(body)}).encode())}
+
+
+class FakeS3:
+    def __init__(self):
+        self.buckets = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.buckets.append(Bucket)
+
+
+class FakeCloudWatch:
+    def __init__(self):
+        self.metric_names = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.metric_names.extend(metric["MetricName"] for metric in MetricData)
+
+
+class FakeBlob:
+    name = "2026/10/14/05/file.zip"
+    size = 100
+
+    def download_as_bytes(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            zip_file.writestr("file.csv", VALID_CSV)
+        return archive.getvalue()
+
+
+class FakeContext:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_lambda_client_waits_out_the_trusted_function_without_retrying():
+    config = index.LAMBDA.meta.config
+
+    assert config.read_timeout > 300
+    assert config.retries["total_max_attempts"] == 1
+
+
+@pytest.mark.parametrize("lambda_client, outcome", [
+    (FakeLambda(transfer_response(["op1", "op2"])), index.DIRECT_DELIVERED),
+    (FakeLambda(transfer_response([])), index.DIRECT_NOT_DELIVERED),
+    (FakeLambda(transfer_response(["op1"])), index.DIRECT_UNCERTAIN),
+    (FakeLambda(transfer_response([], function_error=True)), index.DIRECT_UNCERTAIN),
+    (FakeLambda(error=ClientError({"Error": {"Code": "TooManyRequestsException"}}, "Invoke")), index.DIRECT_NOT_DELIVERED),
+    (FakeLambda(error=EndpointConnectionError(endpoint_url="https://lambda")), index.DIRECT_NOT_DELIVERED),
+    (FakeLambda(error=ReadTimeoutError(endpoint_url="https://lambda")), index.DIRECT_UNCERTAIN),
+], ids=["delivered", "reached-nowhere", "partial", "function-error", "throttled", "never-sent", "read-timeout"])
+def test_transfer_directly_outcomes(lambda_client, outcome):
+    assert index.transfer_directly(lambda_client, "2026/10/14/05/file.csv", VALID_CSV.encode()) == outcome
+
+
+def process(lambda_client, remaining_ms=900000):
+    s3, cloudwatch = FakeS3(), FakeCloudWatch()
+    result = index.process_single_file(FakeBlob(), s3, cloudwatch, lambda_client, FakeContext(remaining_ms))
+    return result, s3.buckets, cloudwatch.metric_names
+
+
+def test_delivered_file_skips_the_trusted_bucket():
+    result, buckets, metrics = process(FakeLambda(transfer_response(["op1", "op2"])))
+
+    assert result is True
+    assert buckets == ["s3-untrusted-bucket"]
+
+
+def test_file_delivered_nowhere_goes_through_the_trusted_bucket():
+    result, buckets, metrics = process(FakeLambda(transfer_response([])))
+
+    assert result is True
+    assert buckets == ["s3-untrusted-bucket", "s3-trusted-bucket"]
+
+
+def test_partial_delivery_is_not_resent_but_counted():
+    result, buckets, metrics = process(FakeLambda(transfer_response(["op1"])))
+
+    assert result is False
+    assert buckets == ["s3-untrusted-bucket"]
+    assert "UndeliveredFiles" in metrics
+
+
+def test_no_direct_handoff_close_to_the_deadline():
+    lambda_client = FakeLambda(transfer_response(["op1", "op2"]))
+    remaining_ms = index.DIRECT_TRANSFER_READ_TIMEOUT * 1000
+
+    result, buckets, metrics = process(lambda_client, remaining_ms)
+
+    assert result is True
+    assert lambda_client.invocations == 0
+    assert buckets == ["s3-untrusted-bucket", "s3-trusted-bucket"]
@@ -1,15 +1,87 @@
+import json
+import os
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
+
+from untrusted_spoke.untrusted_spoke_stack import UntrustedSpokeStack, layer_code
+
+PROJECT_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+def synth(**context):
+    """Template for the stack as `cdk synth` builds it, with trusted_account_id and the cached VPC lookup"""
+    with open(os.path.join(PROJECT_DIR, "cdk.json")) as f:
+        app_context = json.load(f)["context"]
+    with open(os.path.join(PROJECT_DIR, "cdk.context.json")) as f:
+        app_context.update(json.load(f))
+    app_context.update(context)
+
+    app = core.App(context=app_context)
+    stack = UntrustedSpokeStack(app, "untrusted-spoke",
+        env=core.Environment(account="506294024506", region="il-central-1")
+    )
+    return assertions.Template.from_stack(stack)
+
+
+@pytest.fixture(autouse=True)
+def project_dir(monkeypatch):
+    # Asset paths in the stack are relative to the CDK app
+    monkeypatch.chdir(PROJECT_DIR)
 
-from untrusted_spoke.untrusted_spoke_stack import UntrustedSpokeStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in untrusted_spoke/untrusted_spoke_stack.py
 def test_sqs_queue_created():
+    # The hourly rule's dead-letter queue
+    synth().has_resource_properties("AWS::SQS::Queue", {
+        "MessageRetentionPeriod": 14 * 24 * 3600
+    })
+
+
+def test_trusted_account_id_is_required():
     app = core.App()
-    stack = UntrustedSpokeStack(app, "untrusted-spoke")
-    template = assertions.Template.from_stack(stack)
+    with pytest.raises(ValueError):
+        UntrustedSpokeStack(app, "untrusted-spoke",
+            env=core.Environment(account="506294024506", region="il-central-1")
+        )
+
+
+def test_function_outlasts_a_direct_handoff():
+    synth().has_resource_properties("AWS::Lambda::Function", {
+        "Timeout": 900,
+        "ReservedConcurrentExecutions": 1
+    })
+
+
+def test_failed_runs_are_not_retried():
+    template = synth()
+    template.has_resource_properties("AWS::Lambda::EventInvokeConfig", {
+        "MaximumEventAgeInSeconds": 900,
+        "MaximumRetryAttempts": 0
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "Targets": [assertions.Match.object_like({
+            "RetryPolicy": {"MaximumEventAgeInSeconds": 900, "MaximumRetryAttempts": 2}
+        })]
+    })
+
+
+def test_undelivered_files_raise_an_alarm():
+    synth().has_resource_properties("AWS::CloudWatch::Alarm", {
+        "Namespace": "MOD/FileProcessing",
+        "MetricName": "UndeliveredFiles",
+        "Threshold": 1
+    })
+
+
+def test_vpc_endpoints_reused_from_trusted_stack():
+    synth().resource_count_is("AWS::EC2::VPCEndpoint", 0)
+    synth(create_vpc_endpoints="true").resource_count_is("AWS::EC2::VPCEndpoint", 3)
+
+
+def test_layer_code_requires_sidecar(tmp_path):
+    layer_zip = tmp_path / "layer.zip"
+    layer_zip.write_bytes(b"")
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+    with pytest.raises(FileNotFoundError):
+        layer_code(str(layer_zip))
@@ -1,3 +1,4 @@
+import os
 from aws_cdk import (
     Duration,
     Stack,
@@ -6,24 +7,92 @@ from aws_cdk import (
     aws_events as events,
     aws_events_targets as targets,
     aws_s3 as s3,
+    aws_sqs as sqs,
     aws_iam as iam,
     aws_ec2 as ec2,
     aws_logs as logs,
+    aws_cloudwatch as cloudwatch,
+    AssetHashType,
     Size,
     Tags
 )
 from constructs import Construct
 
+# IAM actions shared by the Lambda policies, built once at import. The two spokes are separate CDK
+# apps with no shared package, so these and layer_code below are also defined in
+# trusted-spoke/trusted_spoke/trusted_spoke_stack.py; change both copies together
+LOGS_ACTIONS = ("logs:CreateLogGroup", "logs:CreateLogStream", "logs:PutLogEvents")
+ENI_ACTIONS = ("ec2:CreateNetworkInterface", "ec2:DescribeNetworkInterfaces", "ec2:DeleteNetworkInterface")
+
+# CloudWatch namespaces lambda/index.py publishes metrics to
+METRIC_NAMESPACES = ("MOD/FileProcessing", "MOD/BatchProcessing")
+
+# Only the handler is function code; layers and helper scripts stay out of the asset
+LAMBDA_CODE_EXCLUDE = ["layers", "*.sh", "__pycache__", "*.pyc", "tests", ".venv"]
+
+def layer_code(path: str) -> lambda_.Code:
+    """Layer code hashed from the zip's .sha256 sidecar instead of re-hashing the zip on every synth"""
+    sidecar = f"{path}.sha256"
+    # A zip without its sidecar means the step that writes it was skipped, so fail the synth
+    # instead of quietly hashing the whole zip again
+    if not os.path.exists(sidecar):
+        raise FileNotFoundError(f"Missing {sidecar}; regenerate it with: sha256sum {path} > {sidecar}")
+    with open(sidecar) as f:
+        asset_hash = f.read().split()[0]
+    return lambda_.Code.from_asset(path, asset_hash=asset_hash, asset_hash_type=AssetHashType.CUSTOM)
+
 class UntrustedSpokeStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Set in cdk.context.json (or with -c trusted_account_id=...) rather than hardcoded here
+        trusted_account_id = self.node.try_get_context("trusted_account_id")
+        if not trusted_account_id:
+            raise ValueError("Missing 'trusted_account_id' context value")
+        
+        # Transfer Lambda in the trusted account, invoked directly for small files
+        trusted_transfer_function_arn = f"arn:aws:lambda:{self.region}:{trusted_account_id}:function:s3-transfer"
+        
+        vpc, lambda_subnets, lambda_sg = self._build_network()
+        untrusted_bucket, trusted_bucket = self._build_storage(trusted_account_id)
+        lambda_role = self._build_iam(untrusted_bucket, trusted_bucket, trusted_transfer_function_arn)
+        transfer_lambda = self._build_compute(vpc, lambda_subnets, lambda_sg, lambda_role,
+            untrusted_bucket, trusted_bucket, trusted_transfer_function_arn
+        )
+        self._build_schedule(transfer_lambda)
+        
+        # Tag every taggable resource in the stack
+        Tags.of(self).add("Project", "TransferSystem")
+        Tags.of(self).add("Environment", "untrusted")
+
+    def _build_network(self) -> tuple[ec2.IVpc, ec2.SubnetSelection, ec2.SecurityGroup]:
+        """The existing VPC, its AWS service endpoints when this stack owns them, and the Lambda's security group"""
         # Use existing VPC
         vpc = ec2.Vpc.from_lookup(self, "UntrustedVpc", 
             vpc_name="sky-vpc"
         )
         
+        # Keep AWS API traffic off the NAT gateway: S3 through a gateway endpoint,
+        # Secrets Manager and CloudWatch metrics through interface endpoints.
+        # sky-vpc is shared with the trusted spoke, whose stack creates these endpoints; the S3 route
+        # and private DNS apply to the whole VPC, so this stack only creates them when deployed
+        # on its own with -c create_vpc_endpoints=true
+        lambda_subnets = ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS)
+        if str(self.node.try_get_context("create_vpc_endpoints")).lower() == "true":
+            vpc.add_gateway_endpoint("S3Endpoint",
+                service=ec2.GatewayVpcEndpointAwsService.S3,
+                subnets=[lambda_subnets]
+            )
+            vpc.add_interface_endpoint("SecretsManagerEndpoint",
+                service=ec2.InterfaceVpcEndpointAwsService.SECRETS_MANAGER,
+                subnets=lambda_subnets
+            )
+            vpc.add_interface_endpoint("CloudWatchMetricsEndpoint",
+                service=ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_MONITORING,
+                subnets=lambda_subnets
+            )
+        
         # Create a security group for the Lambda function
         # Set allow_all_outbound to False to restrict all outbound traffic by default
         lambda_sg = ec2.SecurityGroup(self, "transferLambdaSG",
@@ -33,6 +102,23 @@ class UntrustedSpokeStack(Stack):
             allow_all_outbound=False
         )
         
+        # Add outbound rules for the security group - only allow HTTPS (443) and SSH (22)
+        lambda_sg.add_egress_rule(
+            peer=ec2.Peer.any_ipv4(),
+            connection=ec2.Port.tcp(443),
+            description="HTTPS outbound"
+        )
+        
+        lambda_sg.add_egress_rule(
+            peer=ec2.Peer.any_ipv4(),
+            connection=ec2.Port.tcp(22),
+            description="SSH outbound"
+        )
+        
+        return vpc, lambda_subnets, lambda_sg
+
+    def _build_storage(self, trusted_account_id: str) -> tuple[s3.Bucket, s3.IBucket]:
+        """The untrusted bucket and a reference to the trusted bucket in the other account"""
         # Create S3 untrusted bucket with lifecycle rules
         untrusted_bucket = s3.Bucket(self, "S3UntrustedBucket",
             bucket_name="falcon-project-bucket1",  
@@ -52,166 +138,208 @@ class UntrustedSpokeStack(Stack):
             ]
         )
         
-        # Create Lambda execution role
-        lambda_role = iam.Role(self, "transferLambdaRole",
-            role_name="transfer-Lambda-Role1",
-            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
-        )
-        
         # Reference to the trusted bucket in another account
         trusted_bucket_name = "s3-trusted-bucket"
-        trusted_account_id = "746669204818"  # Replace with the actual account ID of the trusted bucket
         
         trusted_bucket = s3.Bucket.from_bucket_attributes(
             self, "TrustedBucket",
             bucket_name=trusted_bucket_name,
-            account=trusted_account_id
-        )
-        
-        # Add CloudWatch Logs permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "logs:CreateLogGroup",
-                "logs:CreateLogStream",
-                "logs:PutLogEvents"
-            ],
-            resources=["arn:aws:logs:*:*:*"]
-        ))
-        
-        # Add CloudWatch Metrics permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "cloudwatch:PutMetricData"
-            ],
-            resources=["*"]
-        ))
-        
-        # Add S3 bucket access permissions for untrusted bucket
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "s3:GetObject",
-                "s3:PutObject",
-                "s3:ListBucket",
-                "s3:DeleteObject",
-                "s3:CopyObject"
-            ],
-            resources=[
-                untrusted_bucket.bucket_arn,
-                f"{untrusted_bucket.bucket_arn}/*"
-            ]
-        ))
-        
-        # Add S3 bucket access permissions for trusted bucket (cross-account)
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "s3:PutObject",
-                "s3:CopyObject"
-            ],
-            resources=[
-                f"arn:aws:s3:::{trusted_bucket_name}/*",
-                f"arn:aws:s3:::{trusted_bucket_name}"
-            ]
-        ))
-        
-        # Add VPC access permissions
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=[
-                "ec2:CreateNetworkInterface",
-                "ec2:DescribeNetworkInterfaces",
-                "ec2:DeleteNetworkInterface"
-            ],
-            resources=["*"]
-        ))
-        
-        # Add outbound rules for the security group - only allow HTTPS (443) and SSH (22)
-        lambda_sg.add_egress_rule(
-            peer=ec2.Peer.any_ipv4(),
-            connection=ec2.Port.tcp(443),
-            description="HTTPS outbound"
+            account=trusted_account_id,
+            # Both spokes deploy to the same region
+            region=self.region
         )
         
-        lambda_sg.add_egress_rule(
-            peer=ec2.Peer.any_ipv4(),
-            connection=ec2.Port.tcp(22),
-            description="SSH outbound"
+        return untrusted_bucket, trusted_bucket
+
+    def _build_iam(self, untrusted_bucket: s3.Bucket, trusted_bucket: s3.IBucket, trusted_transfer_function_arn: str) -> iam.Role:
+        """The Lambda execution role"""
+        # Create Lambda execution role with its permissions as a single inline policy. The policy is
+        # part of the role itself, so the VPC config's ENI permissions exist before the function
+        lambda_role = iam.Role(self, "transferLambdaRole",
+            role_name="transfer-Lambda-Role1",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            inline_policies={"LambdaPolicy": iam.PolicyDocument(statements=[
+                # Add CloudWatch Logs permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=list(LOGS_ACTIONS),
+                    resources=["arn:aws:logs:*:*:*"]
+                ),
+                # Add S3 bucket access permissions for untrusted bucket
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "s3:GetObject",
+                        "s3:PutObject",
+                        "s3:ListBucket",
+                        "s3:DeleteObject"
+                    ],
+                    resources=[
+                        untrusted_bucket.bucket_arn,
+                        f"{untrusted_bucket.bucket_arn}/*"
+                    ]
+                ),
+                # Add S3 bucket access permissions for trusted bucket (cross-account)
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["s3:PutObject"],
+                    resources=[trusted_bucket.arn_for_objects("*")]
+                ),
+                # Add CloudWatch Metrics permissions; PutMetricData has no resource ARNs,
+                # so it is limited to the namespaces the handler publishes to instead
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["cloudwatch:PutMetricData"],
+                    resources=["*"],
+                    conditions={"StringEquals": {"cloudwatch:namespace": list(METRIC_NAMESPACES)}}
+                ),
+                # Add VPC access permissions
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=list(ENI_ACTIONS),
+                    resources=["*"]
+                ),
+                # Create Secret access for Google Cloud credentials
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["secretsmanager:GetSecretValue"],
+                    resources=[f"arn:aws:secretsmanager:{self.region}:{self.account}:secret:google-cloud-credentials*"]
+                ),
+                # Add invoke permission for the trusted transfer Lambda (cross-account)
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["lambda:InvokeFunction"],
+                    resources=[trusted_transfer_function_arn]
+                )
+            ])}
         )
         
-        # Create Secret access for Google Cloud credentials
-        lambda_role.add_to_policy(iam.PolicyStatement(
-            effect=iam.Effect.ALLOW,
-            actions=["secretsmanager:GetSecretValue"],
-            resources=[f"arn:aws:secretsmanager:{self.region}:{self.account}:secret:google-cloud-credentials*"]
-        ))
-        
+        return lambda_role
+
+    def _build_compute(self, vpc: ec2.IVpc, lambda_subnets: ec2.SubnetSelection, lambda_sg: ec2.SecurityGroup,
+                       lambda_role: iam.Role, untrusted_bucket: s3.Bucket, trusted_bucket: s3.IBucket,
+                       trusted_transfer_function_arn: str) -> lambda_.Function:
+        """The transfer Lambda with its dependencies layer and log group"""
         # Creating Lambda layer for dependencies
         dependencies_layer = lambda_.LayerVersion(self, "GcsDependenciesLayer",
             layer_version_name="gcs-dependencies",
-            code=lambda_.Code.from_asset("./lambda/layers/gcs.zip"),
-            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
-            description="Dependencies for transfer Lambda: google-cloud-storage, tenacity"
+            code=layer_code("./lambda/layers/gcs.zip"),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_12],
+            compatible_architectures=[lambda_.Architecture.ARM_64],
+            description="Dependencies for transfer Lambda: google-cloud-storage (REST transport, no gRPC or proto-plus), tenacity"
+        )
+        
+        # Configure CloudWatch Logs retention; the function logs here directly, so the
+        # group exists before the first invocation instead of racing Lambda's auto-created one
+        transfer_log_group = logs.LogGroup(
+            self, 
+            "falconLambdaLogGroup",
+            log_group_name="/aws/lambda/falcon-project-transfer",
+            retention=logs.RetentionDays.SIX_MONTHS
         )
         
         # Create Lambda function
         transfer_lambda = lambda_.Function(self, "FalconTransferFunction",
             function_name="falcon-project-transfer",
-            runtime=lambda_.Runtime.PYTHON_3_9,
-            code=lambda_.Code.from_asset("./lambda"),
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            architecture=lambda_.Architecture.ARM_64,
+            code=lambda_.Code.from_asset("./lambda", exclude=LAMBDA_CODE_EXCLUDE),
             handler="index.lambda_handler",
-            timeout=Duration.minutes(5),
-            memory_size=2048,
+            # Each direct handoff can wait up to 330 s on the trusted function's 5 minute timeout; the
+            # handler stops handing files off once less than that is left, so one slow handoff
+            # can't time out the rest of the sweep
+            timeout=Duration.minutes(15),
+            # 1769 MB is one full vCPU; S3 streams plateau around 45-58 MB/s per stream,
+            # so memory beyond this only adds GB-seconds without adding throughput.
+            # Override with -c transfer_memory_mb=... once Power Tuning picks a better value
+            memory_size=int(self.node.try_get_context("transfer_memory_mb") or 1769),
+            # GCS archives are downloaded and extracted under /tmp
             ephemeral_storage_size=Size.mebibytes(4096),
+            # Each run sweeps the whole current-hour folder, so a second concurrent run (a manual
+            # invoke or an overlapping schedule event) would only transfer the same files again;
+            # Lambda queues throttled async events and delivers them once the running one finishes
+            reserved_concurrent_executions=1,
             environment={
                 "DESTINATION_PATH": "/tmp",  
                 "S3_BUCKET_NAME": untrusted_bucket.bucket_name, 
-                "TRUSTED_S3_BUCKET": trusted_bucket_name,
+                "TRUSTED_S3_BUCKET": trusted_bucket.bucket_name,
+                "TRUSTED_TRANSFER_FUNCTION": trusted_transfer_function_arn,
                 "GOOGLE_CREDS_SECRET_NAME": "google-cloud-credentials",  
                 "GCS_BUCKET_NAME": "falcon-project"  
             },
+            # Stays in the VPC so the security group limits egress; Hyperplane ENIs are set up when
+            # the function is deployed, not on cold starts, so this adds no invocation latency
             vpc=vpc,
-            vpc_subnets=ec2.SubnetSelection(
-                subnet_type=ec2.SubnetType.PRIVATE_WITH_NAT
-            ),
+            vpc_subnets=lambda_subnets,
             security_groups=[lambda_sg],
             role=lambda_role,
-            layers=[dependencies_layer]
+            layers=[dependencies_layer],
+            log_group=transfer_log_group
         )
         
-        # Configure CloudWatch Logs retention
-        logs.LogGroup(
-            self, 
-            "falconLambdaLogGroup",
-            log_group_name=f"/aws/lambda/{transfer_lambda.function_name}",
-            retention=logs.RetentionDays.SIX_MONTHS
+        # Files the trusted function may have delivered to only some locations aren't resent
+        # automatically, so each one raises this alarm for a manual redelivery
+        cloudwatch.Alarm(self, "UndeliveredFilesAlarm",
+            alarm_name="falcon-project-undelivered-files",
+            alarm_description="Valid files that may have reached only some on-premises locations; redeliver them from the untrusted bucket",
+            metric=cloudwatch.Metric(
+                namespace="MOD/FileProcessing",
+                metric_name="UndeliveredFiles",
+                statistic="Sum",
+                period=Duration.hours(1)
+            ),
+            threshold=1,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
         )
         
+        return transfer_lambda
+
+    def _build_schedule(self, transfer_lambda: lambda_.Function) -> None:
+        """The hourly EventBridge rule that invokes the transfer Lambda"""
         # Create CloudWatch Scheduled Event to trigger Lambda hourly
-        hourly_schedule = events.Schedule.cron(
-            minute="0",
-            hour="*",
-            month="*",
-            week_day="*",
-            year="*"
+        # Fields left out default to every value, so this fires at the top of each hour. It stays a
+        # cron rather than a rate: the handler picks up the current hour's folder, and a rate
+        # would drift to whatever minute the rule was deployed at
+        hourly_schedule = events.Schedule.cron(minute="0")
+        
+        # An hour between runs means every run is a cold start. Provisioned concurrency on a "live"
+        # alias keeps one environment initialized, but it bills around the clock, so it stays off
+        # unless -c transfer_provisioned_concurrency=1 is set (it can't exceed the reserved 1)
+        schedule_target = transfer_lambda
+        provisioned_concurrency = int(self.node.try_get_context("transfer_provisioned_concurrency") or 0)
+        if provisioned_concurrency:
+            schedule_target = transfer_lambda.add_alias("live",
+                provisioned_concurrent_executions=provisioned_concurrency
+            )
+        
+        # Retry policy: a run that fails is not retried. It may already have handed part of the folder
+        # to the trusted spoke, and a re-run would send those files again; transient GCS errors are
+        # retried inside the run, per download. EventBridge's limits below end once Lambda accepts
+        # the event, and Lambda's own async queue would otherwise hold a throttled run for up to
+        # 6 hours and retry it twice, so it too lets the event go after 15 minutes. The settings are
+        # on the target that is actually invoked
+        schedule_target.configure_async_invoke(
+            max_event_age=Duration.minutes(15),
+            retry_attempts=0
         )
         
-        events.Rule(self, "HourlytransferRule",
-            schedule=hourly_schedule,
-            targets=[targets.LambdaFunction(transfer_lambda)]
+        # Deliveries EventBridge gives up on are kept for two weeks instead of being dropped,
+        # so a missed hour shows up and can be re-run by hand. A sweep that started and then failed
+        # is not re-run and doesn't land here; it shows up in the function's Errors metric
+        schedule_dlq = sqs.Queue(self, "HourlytransferDLQ",
+            retention_period=Duration.days(14)
         )
         
-        # Add tags to resources
-        all_resources = [
-            untrusted_bucket,
-            lambda_sg,
-            lambda_role,
-            transfer_lambda,
-            dependencies_layer
-        ]
-        
-        for resource in all_resources:
-            Tags.of(resource).add("Project", "TransferSystem")
-            Tags.of(resource).add("Environment", "untrusted")
\ No newline at end of file
+        events.Rule(self, "HourlytransferRule",
+            schedule=hourly_schedule,
+            targets=[targets.LambdaFunction(schedule_target,
+                dead_letter_queue=schedule_dlq,
+                # The handler sweeps the folder of the hour it runs in, so a delivery retried
+                # past that hour would pick up the wrong folder. These retries only repeat
+                # EventBridge's hand-off to Lambda, which never started a run
+                max_event_age=Duration.minutes(15),
+                retry_attempts=2
+            )]
+        )
\ No newline at end of file